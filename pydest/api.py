@@ -1,10 +1,16 @@
 import aiohttp
+import asyncio
+import collections
+import copy
+import hashlib
 import re
 import json
+import time
 import urllib
 from functools import partial
 
 import pydest
+from pydest.concurrency import bounded_map
 
 
 PLATFORM_URL = 'https://www.bungie.net/Platform'
@@ -14,10 +20,31 @@ USER_URL = f'{PLATFORM_URL}/User'
 CONTENT_URL = f'{PLATFORM_URL}/Content'
 GROUP_URL = f'{PLATFORM_URL}/GroupV2'
 
+# Default number of seconds responses of read-only endpoints may be cached for
+CACHE_TTLS = {
+    'get_public_milestones': 300,
+    'get_historical_stats_definition': 86400,
+    'get_clan_weekly_reward_state': 300,
+    'get_group': 300,
+    'get_milestone_definitions': 3600,
+    # Only cached when the API is created with cache_authenticated
+    'get_membership_current_user': 300,
+}
+
 GROUP_FILTER_NONE = 0
 GROUP_TYPE_CLAN = 1
 
 
+def _discard_tasks(tasks):
+    """Cancel tasks whose results are no longer needed, retrieving any exception they ended with"""
+    for task in tasks:
+        if task.done():
+            if not task.cancelled():
+                task.exception()
+        else:
+            task.cancel()
+
+
 class API:
     """This module contains async requests for the Destiny 2 API.
     There is some documentation provided here as to how to use
@@ -26,41 +53,213 @@ class API:
     found at https://bungie-net.github.io/multi/index.html
     """
 
-    def __init__(self, session, client_id=None, client_secret=None):
+    def __init__(self, session, client_id=None, client_secret=None, rate_limiter=None, retry_policy=None,
+                 coalesce_requests=False, response_cache=None, cache_ttls=None, cache_authenticated=False,
+                 pgcr_store=None):
+        """
+        Args:
+            session (aiohttp.ClientSession):
+                Session used to make requests
+            client_id (str) [optional]:
+                Bungie.net application client id
+            client_secret (str) [optional]:
+                Bungie.net application client secret
+            rate_limiter (pydest.ratelimit.RateLimiter) [optional]:
+                Rate limiter every request has to pass through
+            retry_policy (pydest.retry.RetryPolicy) [optional]:
+                Policy for retrying requests which failed because of a transient error
+            coalesce_requests (bool) [optional]:
+                Share a single response between identical GET requests made at the same time
+            response_cache (pydest.cache.MemoryResponseCache or SQLiteResponseCache) [optional]:
+                Cache for the responses of read-only endpoints
+            cache_ttls (dict) [optional]:
+                Number of seconds to cache responses for, keyed by endpoint method name.
+                Overrides the defaults in CACHE_TTLS, and a TTL of 0 disables caching.
+            cache_authenticated (bool) [optional]:
+                Also cache responses to requests made with an access token
+            pgcr_store (pydest.pgcr.PGCRStore) [optional]:
+                Permanent store that Post Game Carnage Reports are read through
+        """
         self.session = session
         self.client_id = client_id
         self.client_secret = client_secret
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy
+        self.coalesce_requests = coalesce_requests
+        self.coalesced = 0
+        self._inflight = {}
+        self.response_cache = response_cache
+        self.cache_ttls = dict(CACHE_TTLS, **(cache_ttls or {}))
+        self.cache_authenticated = cache_authenticated
+        self.pgcr_store = pgcr_store
+
+    async def _request(self, req_type, url, access_token=None, params=None, data=None, headers=None,
+                       return_headers=False):
+        """Make an async HTTP request and attempt to return json (dict)
+
+        If return_headers is set, a (json, response headers) tuple is returned instead,
+        where json is None if the server answered 304 Not Modified.
+
+        With coalesce_requests set, identical GET requests made while one is already
+        in flight share its response. Every caller but the last to receive it gets
+        its own copy, so callers can't see each other's changes to the result.
+        """
+        if req_type != 'GET' or not self.coalesce_requests:
+            return await self._perform_request(req_type, url, access_token, params, data, headers, return_headers)
 
-    async def _request(self, req_type, url, access_token=None, params=None, data=None):
-        """Make an async HTTP request and attempt to return json (dict)"""
-        headers = {}
+        key = (req_type, urllib.parse.quote(url, safe=':/?&=,.'),
+               tuple(sorted((k, str(v)) for k, v in (params or {}).items())),
+               access_token, tuple(sorted((headers or {}).items())), return_headers)
+        return await self._single_flight(
+            key, lambda: self._perform_request(req_type, url, access_token, params, data, headers, return_headers))
+
+    async def _single_flight(self, key, factory):
+        """Share the result of a coroutine between every caller using the same key at the same time
+
+        Every caller but the last to receive the result gets its own deep copy of it.
+
+        Args:
+            key:
+                Hashable key identifying the work
+            factory (callable):
+                Called to create the coroutine if no work with the same key is in flight
+        """
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            task = asyncio.ensure_future(factory())
+            inflight = self._inflight[key] = {'task': task, 'waiters': 0}
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+
+        inflight['waiters'] += 1
+        # A cancelled caller must not cancel the work shared with the others
+        result = await asyncio.shield(inflight['task'])
+        inflight['waiters'] -= 1
+        if inflight['waiters'] == 0:
+            return result
+        return copy.deepcopy(result)
+
+    async def _perform_request(self, req_type, url, access_token=None, params=None, data=None, headers=None,
+                               return_headers=False):
+        """Make a single async HTTP request, retrying it according to the retry policy"""
+        headers = dict(headers) if headers else {}
         if access_token:
             headers.update({'Authorization': f"Bearer {access_token}"})
         encoded_url = urllib.parse.quote(url, safe=':/?&=,.')
-        try:
-            async with self.session.request(req_type, encoded_url, headers=headers, params=params, json=data) as r:
-                if r.status == 401:
-                    raise pydest.PydestTokenException(
-                        "Access token has expired, refresh needed")
-                else:
-                    json_res = await r.json()
-        except aiohttp.ClientResponseError:
+
+        policy = self.retry_policy
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire(encoded_url)
+            send = self._send(req_type, encoded_url, headers, params, data)
+            remaining = policy.remaining(time.monotonic() - started) if policy is not None else None
+            if remaining is not None:
+                # An attempt still running at the deadline is abandoned, and is the last one
+                send = asyncio.wait_for(send, max(remaining, 0))
+            try:
+                status, json_res, response_headers = await send
+                error = None
+                throttle_seconds = json_res.get('ThrottleSeconds') if json_res is not None else 0
+                if throttle_seconds and self.rate_limiter is not None:
+                    self.rate_limiter.throttle(encoded_url, throttle_seconds)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status = getattr(e, 'status', None)
+                json_res, response_headers, error, throttle_seconds = None, None, e, 0
+            if policy is None:
+                break
+
+            error_code = json_res.get('ErrorCode') if json_res is not None else None
+            reason = policy.retry_reason(req_type, status, error_code, error)
+            delay = None
+            if reason is not None:
+                delay = policy.delay(attempt, throttle_seconds)
+                if not policy.should_retry(attempt, time.monotonic() - started, delay):
+                    delay = None
+            policy.record(req_type, encoded_url, attempt, reason, delay)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+
+        if error is not None:
             raise pydest.PydestException("Could not connect to Bungie.net")
 
-        message = json_res.get('Message')
-        error_code = json_res.get('ErrorCode')
-        if message != 'Ok':
-            error = f"ErrorCode: {json_res.get('ErrorCode')} - {message}"
-            if error_code == 5:
-                raise pydest.PydestMaintenanceException(error)
-            if error_code == 1665:
-                raise pydest.PydestPrivateHistoryException(error)
-            raise pydest.PydestException(error)
+        if json_res is not None:
+            message = json_res.get('Message')
+            error_code = json_res.get('ErrorCode')
+            if message != 'Ok':
+                error = f"ErrorCode: {json_res.get('ErrorCode')} - {message}"
+                if error_code == 5:
+                    raise pydest.PydestMaintenanceException(error)
+                if error_code == 1665:
+                    raise pydest.PydestPrivateHistoryException(error)
+                raise pydest.PydestException(error)
+        if return_headers:
+            return json_res, response_headers
         return json_res
 
-    async def _get_request(self, url, params=None, access_token=None):
+    async def _send(self, req_type, encoded_url, headers, params, data):
+        """Send a single HTTP request
+
+        Returns:
+            tuple: (HTTP status, json (dict) or None if not modified, response headers)
+        """
+        async with self.session.request(req_type, encoded_url, headers=headers, params=params, json=data) as r:
+            if r.status == 401:
+                raise pydest.PydestTokenException(
+                    "Access token has expired, refresh needed")
+            elif r.status == 304:
+                json_res = None
+            else:
+                json_res = await r.json()
+            return r.status, json_res, r.headers
+
+    async def _get_request(self, url, params=None, access_token=None, headers=None, return_headers=False):
         """Make an async GET request and attempt to return json (dict)"""
-        return await self._request('GET', url, access_token=access_token, params=params)
+        return await self._request('GET', url, access_token=access_token, params=params, headers=headers,
+                                   return_headers=return_headers)
+
+    async def _cached_get_request(self, endpoint, url, params=None, access_token=None, use_cache=True):
+        """Make an async GET request, going through the response cache
+
+        Responses are cached for the TTL configured for the endpoint, shortened by a
+        Cache-Control max-age, and not at all if Cache-Control forbids it. Requests
+        made with an access token are only cached with cache_authenticated set.
+        The cache backend is called from the default executor, as it may block on disk.
+        """
+        ttl = self.cache_ttls.get(endpoint, 0)
+        if (self.response_cache is None or not use_cache or ttl <= 0 or
+                (access_token and not self.cache_authenticated)):
+            return await self._get_request(url, params, access_token=access_token)
+
+        token = hashlib.sha256(access_token.encode()).hexdigest() if access_token else None
+        key = json.dumps([url, sorted((k, str(v)) for k, v in (params or {}).items()), token])
+        loop = asyncio.get_event_loop()
+        cached = await loop.run_in_executor(None, self.response_cache.get, key)
+        if cached is not None:
+            return json.loads(cached)
+
+        json_res, headers = await self._get_request(url, params, access_token=access_token, return_headers=True)
+        ttl = self._cache_control_ttl(headers.get('Cache-Control'), ttl)
+        if ttl > 0:
+            await loop.run_in_executor(None, self.response_cache.set, key, json.dumps(json_res), ttl)
+        return json_res
+
+    @staticmethod
+    def _cache_control_ttl(cache_control, ttl):
+        """Limit a cache TTL according to a Cache-Control header"""
+        if not cache_control:
+            return ttl
+        for directive in cache_control.lower().split(','):
+            name, _, value = directive.strip().partition('=')
+            if name in ('no-store', 'no-cache'):
+                return 0
+            if name in ('max-age', 's-maxage') and value.strip().isdigit():
+                ttl = min(ttl, int(value))
+        return ttl
 
     async def _post_request(self, url, data=None, access_token=None):
         """Make an async POST request and attempt to return json (dict)"""
@@ -92,7 +291,7 @@ class API:
         url = f'{USER_URL}/GetBungieNetUserById/{membership_id}/'
         return await self._get_request(url)
 
-    async def get_membership_current_user(self, access_token):
+    async def get_membership_current_user(self, access_token, use_cache=True):
         """Returns a list of accounts associated with the supplied OAuth access token.
         This will include all linked accounts (even when hidden) if supplied credentials
         permit it.
@@ -100,12 +299,16 @@ class API:
         Args:
            access_token (str):
                 OAuth access token
+           use_cache (bool) [optional]:
+                Set to False to bypass the response cache, which is only used for this
+                method when cache_authenticated is set
 
         Returns:
             json (dict)
         """
         url = f'{USER_URL}/GetMembershipsForCurrentUser/'
-        return await self._get_request(url, access_token=access_token)
+        return await self._cached_get_request('get_membership_current_user', url, access_token=access_token,
+                                              use_cache=use_cache)
 
     async def get_membership_data_by_id(self, membership_id, membership_type=-1):
         """Returns a list of accounts associated with the supplied membership ID and membership
@@ -134,6 +337,27 @@ class API:
         url = f'{DESTINY2_URL}/Manifest'
         return await self._get_request(url)
 
+    async def get_destiny_manifest_if_modified(self, etag=None, last_modified=None):
+        """Returns the current version of the manifest, unless it is unchanged
+
+        Args:
+            etag (str) [optional]:
+                ETag header of a previously retrieved manifest response
+            last_modified (str) [optional]:
+                Last-Modified header of a previously retrieved manifest response
+
+        Returns:
+            tuple: (json (dict), response headers). json is None if the manifest
+                has not been modified since the given ETag or Last-Modified.
+        """
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        url = f'{DESTINY2_URL}/Manifest'
+        return await self._get_request(url, headers=headers, return_headers=True)
+
     async def search_destiny_entities(self, entity_type, search_term, page=0):
         """Gets a page list of Destiny items
 
@@ -152,6 +376,44 @@ class API:
         url = f'{DESTINY2_URL}/Armory/Search/{entity_type}/{search_term}/'
         return await self._get_request(url, params)
 
+    async def iter_search_destiny_entities(self, entity_type, search_term, prefetch=2):
+        """Walks through every page of a Destiny entity search, yielding one entity at a time
+
+        Pages are requested ahead of time, up to the last page announced by the
+        totalResults of the first one, and iteration ends once hasMore is false.
+
+        Args:
+            entity_type (str):
+                The type of entity - ex. 'DestinyInventoryItemDefinition'
+            search_term (str):
+                The term to search for
+            prefetch (int) [optional]:
+                Number of pages requested ahead of the one being consumed
+
+        Yields:
+            dict: a single entity (see Destiny.Definitions.DestinyEntitySearchResultItem)
+        """
+        pages = collections.deque([asyncio.ensure_future(self.search_destiny_entities(entity_type, search_term, 0))])
+        next_page = 1
+        last_page = None
+        try:
+            while pages:
+                json_res = await pages.popleft()
+                results = json_res['Response']['results']
+                for entity in results.get('results') or []:
+                    yield entity
+                if not results.get('hasMore'):
+                    return
+                if last_page is None:
+                    per_page = (results.get('query') or {}).get('itemsPerPage') or len(results.get('results') or [])
+                    total = results.get('totalResults')
+                    last_page = (total - 1) // per_page if total and per_page else float('inf')
+                while next_page <= last_page and len(pages) <= prefetch:
+                    pages.append(asyncio.ensure_future(self.search_destiny_entities(entity_type, search_term, next_page)))
+                    next_page += 1
+        finally:
+            _discard_tasks(pages)
+
     async def search_destiny_player(self, membership_type, display_name):
         """Returns a list of Destiny memberships given a full Gamertag or PSN ID
 
@@ -211,7 +473,7 @@ class API:
         url = f'{DESTINY2_URL}/{membership_type}/Profile/{membership_id}/Character/{character_id}/'
         return await self._get_request(url, params)
 
-    async def get_clan_weekly_reward_state(self, group_id):
+    async def get_clan_weekly_reward_state(self, group_id, use_cache=True):
         """
         Verb: GET
         Path: /Clan/{groupId}/WeeklyRewardState/
@@ -222,12 +484,14 @@ class API:
         Args:
             group_id (int):
                 A valid group ID of a clan
+            use_cache (bool) [optional]:
+                Set to False to bypass the response cache
 
         Returns:
             json (dict)
         """
         url = f'{DESTINY2_URL}/Clan/{group_id}/WeeklyRewardState/'
-        return await self._get_request(url)
+        return await self._cached_get_request('get_clan_weekly_reward_state', url, use_cache=use_cache)
 
     async def get_item(self, membership_type, membership_id, item_instance_id, components):
         """Retrieve the details of an instanced Destiny Item. An instanced Destiny
@@ -257,6 +521,10 @@ class API:
     async def get_post_game_carnage_report(self, activity_id):
         """Gets the available post game carnage report for the activity ID
 
+        If the API has a pgcr_store, reports are read from it when possible and
+        stored in it once retrieved, and concurrent requests for the same report
+        are sent only once.
+
         Args:
             activity_id (int):
                 The ID of the activity whose PGCR is requested
@@ -265,16 +533,63 @@ class API:
             json (dict)
         """
         url = f'{DESTINY2_URL}/Stats/PostGameCarnageReport/{activity_id}/'
-        return await self._get_request(url)
+        if self.pgcr_store is None:
+            return await self._get_request(url)
+        return await self._single_flight(('PGCR', int(activity_id)), lambda: self._read_through_pgcr(activity_id, url))
+
+    async def _read_through_pgcr(self, activity_id, url):
+        """Get a PGCR from the pgcr_store, retrieving and storing it if it is missing"""
+        loop = asyncio.get_event_loop()
+        report = await loop.run_in_executor(None, self.pgcr_store.get, activity_id)
+        if report is None:
+            report = await self._get_request(url)
+            await loop.run_in_executor(None, self.pgcr_store.put, activity_id, report)
+        return report
+
+    async def iter_post_game_carnage_reports(self, activity_ids, concurrency=10, jsonl_path=None):
+        """Gets the post game carnage reports for many activities, yielding them as they arrive
+
+        At most concurrency reports are requested at once, and new requests are only
+        made as results are consumed. A failed request (ex. private history) is
+        yielded along with its exception instead of ending the iteration.
 
-    async def get_historical_stats_definition(self):
+        Args:
+            activity_ids (iterable or async iterable):
+                The IDs of the activities whose PGCRs are requested
+            concurrency (int) [optional]:
+                Maximum number of requests in flight at once
+            jsonl_path (str) [optional]:
+                File to append every retrieved report to, one
+                {"activityId": ..., "report": ...} object per line
+
+        Yields:
+            tuple: (activity_id, json (dict) or None, exception or None)
+        """
+        loop = asyncio.get_event_loop()
+        f_handle = open(jsonl_path, 'a') if jsonl_path else None
+        try:
+            async for activity_id, report, error in bounded_map(self.get_post_game_carnage_report,
+                                                                 activity_ids, concurrency):
+                if f_handle is not None and report is not None:
+                    line = json.dumps({'activityId': activity_id, 'report': report}) + '\n'
+                    await loop.run_in_executor(None, f_handle.write, line)
+                yield activity_id, report, error
+        finally:
+            if f_handle is not None:
+                f_handle.close()
+
+    async def get_historical_stats_definition(self, use_cache=True):
         """Gets historical stats definitions
 
+        Args:
+            use_cache (bool) [optional]:
+                Set to False to bypass the response cache
+
         Returns:
             json (dict)
         """
         url = f'{DESTINY2_URL}/Stats/Definition/'
-        return await self._get_request(url)
+        return await self._cached_get_request('get_historical_stats_definition', url, use_cache=use_cache)
 
     async def get_historical_stats(self, membership_type, membership_id, character_id=0, groups=[], modes=[]):
         """Gets historical stats for indicated character
@@ -327,10 +642,60 @@ class API:
         Returns:
             json(dict)
         """
-        params = {'count': count, 'mode': mode, 'page': page}
+        params = {'count': count, 'page': page}
+        if mode is not None:
+            params['mode'] = mode
         url = f'{DESTINY2_URL}/{membership_type}/Account/{membership_id}/Character/{character_id}/Stats/Activities/'
         return await self._get_request(url, params)
 
+    async def iter_activity_history(self, membership_type, membership_id, character_id=0, mode=None, count=250,
+                                    prefetch=2, stop=None):
+        """Walks through the whole activity history of a character, yielding one activity at a time
+
+        Pages are requested ahead of time, so that the next ones are usually available
+        by the time the current one is consumed. Iteration ends at the first empty or
+        incomplete page, or at the first activity matching stop.
+
+        Args:
+            membership_type (int):
+                A valid non-BungieNet membership type (BungieMembershipType).
+            membership_id (int):
+                The Destiny membershipId of the user to retrieve.
+            character_id (int) [optional]:
+                The id of the character to retrieve activities for. If not provided, activities
+                for all characters will be retrieved.
+            mode (int) [optional]:
+                A filter for the activity mode to be returned. None returns all activities.
+            count (int) [optional]:
+                Number of activities per page, at most 250.
+            prefetch (int) [optional]:
+                Number of pages requested ahead of the one being consumed.
+            stop (callable) [optional]:
+                Called with each activity, newest first; iteration ends as soon as it returns
+                True (ex. lambda a: a['period'] < '2019-01-01T00:00:00Z').
+
+        Yields:
+            dict: a single activity (see Destiny.HistoricalStats.DestinyHistoricalStatsPeriodGroup)
+        """
+        pages = collections.deque()
+        next_page = 0
+        try:
+            while True:
+                while len(pages) <= prefetch:
+                    pages.append(asyncio.ensure_future(self.get_activity_history(
+                        membership_type, membership_id, character_id, count, mode, next_page)))
+                    next_page += 1
+                json_res = await pages.popleft()
+                activities = json_res['Response'].get('activities') or []
+                for activity in activities:
+                    if stop is not None and stop(activity):
+                        return
+                    yield activity
+                if len(activities) < count:
+                    return
+        finally:
+            _discard_tasks(pages)
+
     async def get_public_milestone_content(self, milestone_hash):
         """Gets custom localized content for the milestone of
         the given hash, if it exists.
@@ -345,16 +710,20 @@ class API:
         url = f'{DESTINY2_URL}/Milestones/{milestone_hash}/Content/'
         return await self._get_request(url)
 
-    async def get_public_milestones(self):
+    async def get_public_milestones(self, use_cache=True):
         """Gets information about the current public Milestones
 
+        Args:
+            use_cache (bool) [optional]:
+                Set to False to bypass the response cache
+
         Returns:
             json (dict)
         """
         url = f'{DESTINY2_URL}/Milestones/'
-        return await self._get_request(url)
+        return await self._cached_get_request('get_public_milestones', url, use_cache=use_cache)
 
-    async def get_group(self, group_id):
+    async def get_group(self, group_id, use_cache=True):
         """Get information about a specific group
 
         Path: /GroupV2/{group_id}/
@@ -363,12 +732,14 @@ class API:
         Args:
             group_id (int):
                 The id of the group
+            use_cache (bool) [optional]:
+                Set to False to bypass the response cache
 
         Returns:
             json (dict)
         """
         url = f'{GROUP_URL}/{group_id}/'
-        return await self._get_request(url)
+        return await self._cached_get_request('get_group', url, use_cache=use_cache)
 
     async def get_groups_for_member(self, membership_type, membership_id):
         """Gets information about the groups an individual member has joined
@@ -385,18 +756,66 @@ class API:
         url = f'{GROUP_URL}/User/{membership_type}/{membership_id}/{GROUP_FILTER_NONE}/{GROUP_TYPE_CLAN}/'
         return await self._get_request(url)
 
-    async def get_members_of_group(self, group_id):
+    async def get_members_of_group(self, group_id, page=1):
         """Gets list of members in a group
 
         Args:
             group_id (int):
                 The id of the group
+            page (int) [optional]:
+                Page number to return, starting with 1
 
         Returns:
             json (dict)
         """
+        params = {'currentpage': page}
         url = f'{GROUP_URL}/{group_id}/Members/'
-        return await self._get_request(url)
+        return await self._get_request(url, params)
+
+    async def iter_group_members(self, group_id):
+        """Walks through every page of the members of a group, yielding one member at a time
+
+        Args:
+            group_id (int):
+                The id of the group
+
+        Yields:
+            dict: a single member (see GroupsV2.GroupMember)
+        """
+        page = 1
+        while True:
+            json_res = await self.get_members_of_group(group_id, page)
+            for member in json_res['Response'].get('results') or []:
+                yield member
+            if not json_res['Response'].get('hasMore'):
+                return
+            page += 1
+
+    async def iter_group_profiles(self, group_id, components, concurrency=10):
+        """Gets the profile of every member of a group, yielding them as they arrive
+
+        At most concurrency profiles are requested at once, through the same session and
+        rate limiter as every other request. A failed request is yielded along with its
+        exception instead of ending the iteration.
+
+        Args:
+            group_id (int):
+                The id of the group
+            components (list):
+                A list containing the components to include in each profile
+                (see Destiny.Responses.DestinyProfileResponse).
+            concurrency (int) [optional]:
+                Maximum number of requests in flight at once
+
+        Yields:
+            tuple: (member (dict), json (dict) or None, exception or None)
+        """
+        async def get_member_profile(member):
+            user_info = member['destinyUserInfo']
+            return await self.get_profile(user_info['membershipType'], user_info['membershipId'], components)
+
+        async for result in bounded_map(get_member_profile, self.iter_group_members(group_id), concurrency):
+            yield result
 
     async def get_group_pending_members(self, group_id, access_token):
         """Gets list of pending members in a group
@@ -518,16 +937,18 @@ class API:
         url = f'{GROUP_URL}/{group_id}/Members/Approve/{membership_type}/{membership_id}/'
         return await self._post_request(url, data=data, access_token=access_token)
 
-    async def get_milestone_definitions(self, milestone_hash):
+    async def get_milestone_definitions(self, milestone_hash, use_cache=True):
         """Gets the milestone definition for a given milestone hash
 
         Args:
             milestone_hash (int):
                 The hash value that represents the milestone within the manifest
+            use_cache (bool) [optional]:
+                Set to False to bypass the response cache
 
         Returns:
             json(dict)
         """
         url = f'{DESTINY2_URL}/Manifest/DestinyMilestoneDefinition/{milestone_hash}/'
-        return await self._get_request(url)
+        return await self._cached_get_request('get_milestone_definitions', url, use_cache=use_cache)
  
\ No newline at end of file
@@ -0,0 +1,177 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A bounded in-memory cache which evicts the least recently used entries
+
+    The cache can be bounded by number of entries, by an approximate byte budget,
+    or both. Values stored in the cache are shared between every caller that
+    retrieves them, so they should be treated as read-only.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        """
+        Args:
+            max_entries (int) [optional]:
+                Maximum number of entries to keep
+            max_bytes (int) [optional]:
+                Maximum combined size of the entries to keep, as reported to put()
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """Get a value from the cache, marking it as recently used"""
+        try:
+            value, _ = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, size=1):
+        """Add a value to the cache, evicting older entries if over budget
+
+        Args:
+            key:
+                A hashable key for the value
+            value:
+                The value to store
+            size (int) [optional]:
+                The approximate size of the value in bytes
+        """
+        if key in self._entries:
+            self.size -= self._entries.pop(key)[1]
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        self._entries[key] = (value, size)
+        self.size += size
+        while ((self.max_entries is not None and len(self._entries) > self.max_entries) or
+               (self.max_bytes is not None and self.size > self.max_bytes)):
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+    def discard(self, key):
+        """Remove an entry from the cache if it is present"""
+        if key in self._entries:
+            self.size -= self._entries.pop(key)[1]
+
+    def invalidate(self, predicate):
+        """Remove every entry whose key matches the given predicate"""
+        for key in [k for k in self._entries if predicate(k)]:
+            self.size -= self._entries.pop(key)[1]
+
+    def clear(self):
+        """Remove every entry from the cache"""
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self):
+        """Get the cache counters
+
+        Returns:
+            dict
+        """
+        return {'entries': len(self._entries), 'bytes': self.size, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+
+class MemoryResponseCache:
+    """In-memory backend for the API response cache, bounded by number of entries
+
+    Response cache backends are called from the default executor, so they may be
+    used from several threads.
+    """
+
+    def __init__(self, max_entries=1024):
+        self._cache = LRUCache(max_entries=max_entries)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Get a cached response body, or None if it is missing or has expired"""
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= time.time():
+                self._cache.discard(key)
+                return None
+            return value
+
+    def set(self, key, value, ttl):
+        """Cache a response body for ttl seconds"""
+        with self._lock:
+            self._cache.put(key, (value, time.time() + ttl))
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+class SQLiteResponseCache:
+    """On-disk backend for the API response cache, which survives restarts
+
+    The API calls it from the default executor, so that queries and commits never
+    block the event loop. It may be used from several threads.
+    """
+
+    def __init__(self, db_file):
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("""
+                               CREATE TABLE IF NOT EXISTS responses
+                               (key TEXT PRIMARY KEY, value TEXT, expires REAL)
+                               """)
+            self._conn.commit()
+
+    def get(self, key):
+        """Get a cached response body, or None if it is missing or has expired"""
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= time.time():
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+        return row[0]
+
+    def set(self, key, value, ttl):
+        """Cache a response body for ttl seconds"""
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (key, value, time.time() + ttl))
+            self._conn.commit()
+
+    def purge(self):
+        """Remove every expired response"""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE expires <= ?", (time.time(),))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
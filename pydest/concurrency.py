@@ -0,0 +1,61 @@
+import asyncio
+
+
+async def bounded_map(func, items, concurrency):
+    """Call a coroutine function on every item with bounded concurrency, yielding results as they arrive
+
+    Items are taken from the iterable (or async iterable) only when there is room for
+    another call, so a slow consumer holds back new calls instead of letting results
+    pile up in memory. Exceptions raised by a call are yielded rather than raised,
+    so one failure doesn't stop the others.
+
+    Args:
+        func (coroutine function):
+            Called with each item
+        items (iterable or async iterable):
+            The items to call func with
+        concurrency (int):
+            Maximum number of calls in flight at once
+
+    Yields:
+        tuple: (item, result, exception), where exception is None on success
+    """
+    if hasattr(items, '__aiter__'):
+        iterator = items.__aiter__()
+
+        async def next_item():
+            return await iterator.__anext__()
+    else:
+        iterator = iter(items)
+
+        async def next_item():
+            try:
+                return next(iterator)
+            except StopIteration:
+                raise StopAsyncIteration
+
+    async def call(item):
+        try:
+            return item, await func(item), None
+        except Exception as e:
+            return item, None, e
+
+    pending = set()
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < concurrency:
+                try:
+                    item = await next_item()
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                pending.add(asyncio.ensure_future(call(item)))
+            if not pending:
+                return
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
@@ -1,10 +1,17 @@
+import os
 import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Stay under SQLite's default limit of 999 host parameters per statement
+MAX_QUERY_PARAMS = 900
 
 
 class DBase:
 
-    def __init__(self, db_file):
-        self.conn = sqlite3.connect(db_file)
+    def __init__(self, db_file, conn=None):
+        self._owns_conn = conn is None
+        self.conn = sqlite3.connect(db_file) if conn is None else conn
         self.cur = self.conn.cursor()
 
 
@@ -15,7 +22,7 @@ class DBase:
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self.cur:
             self.cur.close()
-        if self.conn:
+        if self.conn and self._owns_conn:
             self.conn.close()
 
 
@@ -26,3 +33,150 @@ class DBase:
               """
         self.cur.execute(sql.format(definition, identifier, hash_id))
         return self.cur.fetchall()
+
+
+    def query_many(self, hash_ids, definition, identifier):
+        """Look up several entries of a definition table at once
+
+        The identifiers are bound as parameters of ``IN (...)`` queries, split
+        into chunks small enough for SQLite's host parameter limit.
+
+        Returns:
+            list: (identifier, json) rows for every entry that was found
+        """
+        sql = """
+              SELECT {1}, json FROM {0}
+              WHERE {1} IN ({2})
+              """
+        rows = []
+        for start in range(0, len(hash_ids), MAX_QUERY_PARAMS):
+            chunk = hash_ids[start:start + MAX_QUERY_PARAMS]
+            placeholders = ','.join('?' * len(chunk))
+            self.cur.execute(sql.format(definition, identifier, placeholders), chunk)
+            rows.extend(self.cur.fetchall())
+        return rows
+
+
+    def query_all(self, definition, identifier):
+        """Get every entry of a definition table
+
+        Returns:
+            list: (identifier, json) rows
+        """
+        sql = """
+              SELECT {1}, json FROM {0}
+              """
+        self.cur.execute(sql.format(definition, identifier))
+        return self.cur.fetchall()
+
+
+class ConnectionPool:
+    """A pool of long-lived read-only connections to a single manifest file
+
+    Each thread that performs a lookup is handed its own connection, which is
+    opened on first use and reused for every following lookup on that thread.
+    All connections are closed together when the pool is closed.
+
+    Lookups are wrapped in reading() so that a pool which is retired, because a
+    newer manifest has replaced its file, stays open until its last reader is done.
+
+    With a non-zero mmap_size, the file is opened as immutable, which skips all
+    locking, and is read through a memory map instead of SQLite's page cache, so
+    that every process reading the same file shares its pages in the OS page cache.
+    This requires the file never to be modified, which holds for installed manifests.
+    """
+
+    def __init__(self, db_file, mmap_size=0):
+        self.db_file = db_file
+        self.mmap_size = mmap_size
+        self._local = threading.local()
+        self._conns = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self._retired = False
+        self._readers = 0
+        self._on_closed = None
+
+    def _connect(self):
+        uri = 'file:{}?mode=ro'.format(_path_to_uri(self.db_file))
+        if self.mmap_size:
+            uri += '&immutable=1'
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        if self.mmap_size:
+            conn.execute('PRAGMA mmap_size = {:d}'.format(self.mmap_size))
+        return conn
+
+    def connection(self):
+        """Get the connection belonging to the calling thread
+
+        Returns:
+            sqlite3.Connection
+
+        Raises:
+            sqlite3.ProgrammingError if the pool has been closed
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and not self._closed:
+            return conn
+        with self._lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Connection pool is closed")
+            conn = self._connect()
+            self._conns.append(conn)
+        self._local.conn = conn
+        return conn
+
+    def db(self):
+        """Get a DBase bound to the calling thread's pooled connection"""
+        return DBase(self.db_file, conn=self.connection())
+
+    @contextmanager
+    def reading(self):
+        """Keep the pool open while the caller is reading from it"""
+        with self._lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Connection pool is closed")
+            self._readers += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._readers -= 1
+                finished = self._retired and self._readers == 0
+            if finished:
+                self.close()
+
+    def retire(self, on_closed=None):
+        """Close the pool once its last reader is done
+
+        Args:
+            on_closed (callable) [optional]:
+                Called with the database file name once the pool has been closed
+        """
+        with self._lock:
+            self._retired = True
+            self._on_closed = on_closed
+            finished = self._readers == 0
+        if finished:
+            self.close()
+
+    def close(self):
+        """Close every connection opened by the pool"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            conns, self._conns = self._conns, []
+            on_closed, self._on_closed = self._on_closed, None
+        for conn in conns:
+            conn.close()
+        if on_closed is not None:
+            on_closed(self.db_file)
+
+
+def _path_to_uri(path):
+    """Quote a filesystem path for use in an SQLite URI filename"""
+    path = os.path.abspath(path).replace('\\', '/')
+    for char, escaped in (('%', '%25'), ('?', '%3f'), ('#', '%23')):
+        path = path.replace(char, escaped)
+    return path
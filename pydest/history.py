@@ -0,0 +1,100 @@
+import asyncio
+import sqlite3
+import threading
+
+
+class ActivityHistorySync:
+    """Incrementally synchronizes activity histories, returning only activities not seen before
+
+    For every (membership, character, mode) the newest activity seen is kept as a
+    high-water mark in an SQLite database. A sync only walks the history back to
+    that mark, so polling an active account costs a single small request, and the
+    marks survive restarts.
+    """
+
+    def __init__(self, api, db_file):
+        """
+        Args:
+            api (pydest.API):
+                API used to retrieve activity histories
+            db_file (str):
+                Path of the SQLite database holding the high-water marks, created if needed
+        """
+        self.api = api
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("""
+                               CREATE TABLE IF NOT EXISTS marks
+                               (membership_id INTEGER, character_id INTEGER, mode INTEGER,
+                                instance_id TEXT, period TEXT,
+                                PRIMARY KEY (membership_id, character_id, mode))
+                               """)
+            self._conn.commit()
+
+    def get_mark(self, membership_id, character_id=0, mode=None):
+        """Get the newest activity seen so far
+
+        Returns:
+            tuple: (instanceId, period) of the activity, or None if nothing was synchronized yet
+        """
+        with self._lock:
+            row = self._conn.execute("""
+                                     SELECT instance_id, period FROM marks
+                                     WHERE membership_id = ? AND character_id = ? AND mode = ?
+                                     """, (int(membership_id), int(character_id), mode or 0)).fetchone()
+        return row
+
+    def set_mark(self, membership_id, character_id, mode, instance_id, period):
+        """Record the newest activity seen"""
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO marks VALUES (?, ?, ?, ?, ?)",
+                               (int(membership_id), int(character_id), mode or 0, str(instance_id), period))
+            self._conn.commit()
+
+    async def sync(self, membership_type, membership_id, character_id=0, mode=None, count=None, prefetch=0):
+        """Get the activities played since the last sync
+
+        The first sync for a character walks its entire history. Later syncs stop at
+        the newest activity returned by the previous one. The mark is only moved once
+        all new activities have been retrieved, so a failed sync can simply be retried.
+
+        Args:
+            membership_type (int):
+                A valid non-BungieNet membership type (BungieMembershipType)
+            membership_id (int):
+                The Destiny membershipId of the user
+            character_id (int) [optional]:
+                The id of the character, or 0 for all characters
+            mode (int) [optional]:
+                A filter for the activity mode. None syncs all activities.
+            count (int) [optional]:
+                Number of activities per page, 25 when a mark exists and 250 otherwise
+            prefetch (int) [optional]:
+                Number of pages requested ahead of the one being read
+
+        Returns:
+            list: the new activities, newest first
+        """
+        loop = asyncio.get_event_loop()
+        mark = await loop.run_in_executor(None, self.get_mark, membership_id, character_id, mode)
+        if count is None:
+            count = 25 if mark else 250
+
+        def seen(activity):
+            if mark is None:
+                return False
+            mark_id, mark_period = mark
+            return activity['activityDetails']['instanceId'] == mark_id or activity['period'] < mark_period
+
+        activities = [activity async for activity in self.api.iter_activity_history(
+            membership_type, membership_id, character_id, mode=mode, count=count, prefetch=prefetch, stop=seen)]
+        if activities:
+            newest = activities[0]
+            await loop.run_in_executor(None, self.set_mark, membership_id, character_id, mode,
+                                       newest['activityDetails']['instanceId'], newest['period'])
+        return activities
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,116 @@
+import asyncio
+
+# Fields of API responses holding the hash of a Manifest entity, and the definition it refers to
+HASH_FIELDS = {
+    'itemHash': 'DestinyInventoryItemDefinition',
+    'emblemHash': 'DestinyInventoryItemDefinition',
+    'plugItemHash': 'DestinyInventoryItemDefinition',
+    'plugHash': 'DestinyInventoryItemDefinition',
+    'bucketHash': 'DestinyInventoryBucketDefinition',
+    'classHash': 'DestinyClassDefinition',
+    'raceHash': 'DestinyRaceDefinition',
+    'genderHash': 'DestinyGenderDefinition',
+    'statHash': 'DestinyStatDefinition',
+    'activityHash': 'DestinyActivityDefinition',
+    'directorActivityHash': 'DestinyActivityDefinition',
+    'activityModeHash': 'DestinyActivityModeDefinition',
+    'destinationHash': 'DestinyDestinationDefinition',
+    'placeHash': 'DestinyPlaceDefinition',
+    'progressionHash': 'DestinyProgressionDefinition',
+    'factionHash': 'DestinyFactionDefinition',
+    'objectiveHash': 'DestinyObjectiveDefinition',
+    'milestoneHash': 'DestinyMilestoneDefinition',
+    'vendorHash': 'DestinyVendorDefinition',
+    'perkHash': 'DestinySandboxPerkDefinition',
+    'damageTypeHash': 'DestinyDamageTypeDefinition',
+    'talentGridHash': 'DestinyTalentGridDefinition',
+    'recordHash': 'DestinyRecordDefinition',
+    'collectibleHash': 'DestinyCollectibleDefinition',
+    'loreHash': 'DestinyLoreDefinition',
+}
+
+
+def definition_key(field):
+    """Get the key under which the definition for a hash field is attached (ex. itemHash -> itemDefinition)"""
+    if field.endswith('Hash'):
+        field = field[:-len('Hash')]
+    return field + 'Definition'
+
+
+def collect_hashes(response, fields=HASH_FIELDS):
+    """Find every hash in an API response, grouped by the definition it refers to
+
+    Args:
+        response (dict or list):
+            The json returned by an API call
+        fields (dict) [optional]:
+            Maps the name of a hash field to the definition it refers to
+
+    Returns:
+        dict: set of hashes for each definition
+    """
+    return _group(_walk(response, fields), fields)
+
+
+async def hydrate(manifest, response, language='en', fields=None, inline=False):
+    """Decode every hash in an API response, with one batched Manifest lookup per definition
+
+    Args:
+        manifest (pydest.manifest.Manifest):
+            The Manifest used to decode the hashes
+        response (dict or list):
+            The json returned by an API call
+        language (str) [optional]:
+            The language to use when retrieving results from the Manifest
+        fields (dict) [optional]:
+            Maps the name of a hash field to the definition it refers to, defaults to HASH_FIELDS
+        inline (bool) [optional]:
+            Also attach each definition next to its hash, under the key given by definition_key
+            (ex. itemDefinition next to itemHash). This modifies the response in place.
+
+    Returns:
+        dict: json (dict) of each hash, or None if it isn't in the Manifest,
+            keyed by definition then by hash
+
+    Raises:
+        PydestException
+    """
+    fields = HASH_FIELDS if fields is None else fields
+    # The matches are kept so that definitions can be attached without walking the response again
+    matches = list(_walk(response, fields))
+    found = _group(matches, fields)
+    definitions = list(found)
+    decoded = await asyncio.gather(*[manifest.decode_hashes(found[definition], definition, language)
+                                     for definition in definitions])
+    table = dict(zip(definitions, decoded))
+
+    if inline:
+        for node, field, hash_id in matches:
+            definition = table[fields[field]][hash_id]
+            if definition is not None:
+                node[definition_key(field)] = definition
+    return table
+
+
+def _walk(node, fields):
+    """Yield (dict, field, hash) for every non-zero hash field found in the json"""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key in fields and isinstance(value, int) and not isinstance(value, bool):
+                    if value:
+                        yield node, key, value
+                elif isinstance(value, (dict, list)):
+                    stack.append(value)
+        elif isinstance(node, list):
+            stack.extend(v for v in node if isinstance(v, (dict, list)))
+
+
+def _group(matches, fields):
+    """Group the hashes yielded by _walk by the definition they refer to"""
+    found = {}
+    for node, field, hash_id in matches:
+        found.setdefault(fields[field], set()).add(hash_id)
+    return found
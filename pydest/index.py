@@ -0,0 +1,194 @@
+import difflib
+import json
+import os
+import re
+import sqlite3
+import tempfile
+
+from pydest.dbase import _path_to_uri
+
+INDEX_SUFFIX = '.index'
+
+
+def index_file(manifest_file):
+    """Get the path of the index sidecar belonging to a manifest file"""
+    return manifest_file + INDEX_SUFFIX
+
+
+def build_index(manifest_file, identifiers, definitions=(), fields=None):
+    """Build the index sidecar of a manifest file, unless an up to date one exists
+
+    The names and descriptions (displayProperties) of every entry of the given
+    definitions are put in an SQLite FTS5 table, and the values found at the
+    given JSON paths are put in an ordinary indexed table. Each element of an
+    array is indexed separately. The sidecar is written under a temporary name
+    and moved into place once complete.
+
+    Args:
+        manifest_file (str):
+            Path of the manifest database
+        identifiers (dict):
+            Column identifying the entries of each definition table
+        definitions (list) [optional]:
+            The definitions whose names are indexed
+        fields (dict) [optional]:
+            The JSON paths indexed for each definition (ex. {'DestinyInventoryItemDefinition': ['itemType']})
+
+    Raises:
+        sqlite3.OperationalError if a definition table doesn't exist
+    """
+    target = index_file(manifest_file)
+    config = _config(definitions, fields)
+    if index_config(target) == config:
+        return
+
+    fd, staged = tempfile.mkstemp(prefix='.pydest-', suffix=INDEX_SUFFIX, dir=os.path.dirname(target) or '.')
+    os.close(fd)
+    try:
+        conn = sqlite3.connect('file:{}'.format(_path_to_uri(staged)), uri=True)
+        try:
+            conn.execute("ATTACH DATABASE ? AS manifest", ('file:{}?mode=ro'.format(_path_to_uri(manifest_file)),))
+            conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute("""
+                         CREATE VIRTUAL TABLE names USING fts5
+                         (definition UNINDEXED, id UNINDEXED, name, description,
+                          tokenize = 'unicode61 remove_diacritics 2')
+                         """)
+            conn.execute("CREATE VIRTUAL TABLE names_vocab USING fts5vocab(names, 'row')")
+            conn.execute("""
+                         CREATE TABLE fields
+                         (definition TEXT, path TEXT, value, id,
+                          PRIMARY KEY (definition, path, value, id)) WITHOUT ROWID
+                         """)
+            for definition in definitions:
+                conn.execute("""
+                             INSERT INTO names
+                             SELECT ?, {1}, json_extract(data, '$.displayProperties.name'),
+                                    json_extract(data, '$.displayProperties.description')
+                             FROM (SELECT {1}, CAST(json AS TEXT) AS data FROM manifest.{0})
+                             WHERE json_extract(data, '$.displayProperties.name') != ''
+                             """.format(definition, identifiers[definition]), (definition,))
+            for definition, paths in config['fields'].items():
+                for path in paths:
+                    conn.execute("""
+                                 INSERT OR IGNORE INTO fields
+                                 SELECT ?, ?, value.value, entry.id
+                                 FROM (SELECT {1} AS id, CAST(json AS TEXT) AS data FROM manifest.{0}) AS entry,
+                                      json_each(entry.data, ?) AS value
+                                 WHERE value.type NOT IN ('object', 'array')
+                                 """.format(definition, identifiers[definition]),
+                                 (definition, path, '$.' + path))
+            conn.execute("INSERT INTO meta VALUES ('config', ?)", (json.dumps(config),))
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(staged, target)
+    except BaseException:
+        os.remove(staged)
+        raise
+
+
+def index_config(index):
+    """Get what an index sidecar contains
+
+    Returns:
+        dict: sorted definitions whose names are indexed under 'names', and sorted
+            indexed paths keyed by definition under 'fields', or None if the
+            sidecar doesn't exist
+    """
+    if not os.path.isfile(index):
+        return None
+    conn = sqlite3.connect('file:{}?mode=ro'.format(_path_to_uri(index)), uri=True)
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'config'").fetchone()
+    except sqlite3.DatabaseError:
+        row = None
+    finally:
+        conn.close()
+    return json.loads(row[0]) if row else None
+
+
+def search_names(conn, term, definition, limit=10, fuzzy=True):
+    """Find the entries of a definition whose name or description match a search term
+
+    Every word of the term is matched as a prefix, so 'ace spa' finds 'Ace of Spades'.
+    Matches in the name rank above matches in the description. When nothing
+    matches and fuzzy is true, each word is replaced by the indexed words closest
+    to it, so misspelled terms still find results.
+
+    Args:
+        conn (sqlite3.Connection):
+            Connection to an index sidecar
+        term (str):
+            The search term
+        definition (str):
+            The type of entity to search (ex. 'DestinyInventoryItemDefinition')
+        limit (int) [optional]:
+            Maximum number of results
+        fuzzy (bool) [optional]:
+            Fall back to approximate matching when nothing matches exactly
+
+    Returns:
+        list: identifiers of the matching entries, best match first
+    """
+    words = re.findall(r'\w+', term.lower())
+    if not words:
+        return []
+    ids = _match(conn, [[word] for word in words], definition, limit)
+    if ids or not fuzzy:
+        return ids
+
+    alternatives = []
+    for word in words:
+        terms = [row[0] for row in conn.execute("SELECT term FROM names_vocab WHERE length(term) BETWEEN ? AND ?",
+                                                (len(word) - 2, len(word) + 2))]
+        close = difflib.get_close_matches(word, terms, n=3, cutoff=0.7)
+        if not close:
+            return []
+        alternatives.append(close)
+    return _match(conn, alternatives, definition, limit)
+
+
+def query_fields(conn, definition, filters):
+    """Find the entries of a definition whose indexed fields have the given values
+
+    Args:
+        conn (sqlite3.Connection):
+            Connection to an index sidecar
+        definition (str):
+            The type of entity to query (ex. 'DestinyInventoryItemDefinition')
+        filters (dict):
+            The value required at each JSON path, or a list of accepted values
+            (ex. {'itemType': 3, 'inventory.tierType': [5, 6]})
+
+    Returns:
+        list: identifiers of the matching entries, in ascending order
+    """
+    queries = []
+    params = []
+    for path, value in filters.items():
+        values = list(value) if isinstance(value, (list, tuple, set, frozenset)) else [value]
+        queries.append("SELECT id FROM fields WHERE definition = ? AND path = ? AND value IN ({})".format(
+            ','.join('?' * len(values))))
+        params.extend([definition, path] + values)
+    sql = "SELECT id FROM ({}) ORDER BY id".format(' INTERSECT '.join(queries))
+    return [row[0] for row in conn.execute(sql, params)]
+
+
+def _config(definitions, fields):
+    """Normalize the contents of an index sidecar, for comparison with an existing one"""
+    return {'names': sorted(definitions),
+            'fields': {definition: sorted(paths) for definition, paths in sorted((fields or {}).items())}}
+
+
+def _match(conn, alternatives, definition, limit):
+    """Run a prefix query requiring one of the alternatives given for every word"""
+    query = ' AND '.join('({})'.format(' OR '.join('"{}"*'.format(w.replace('"', '""')) for w in words))
+                         for words in alternatives)
+    rows = conn.execute("""
+                        SELECT id FROM names
+                        WHERE names MATCH ? AND definition = ?
+                        ORDER BY bm25(names, 0, 0, 10, 1)
+                        LIMIT ?
+                        """, (query, definition, limit))
+    return [row[0] for row in rows]
@@ -1,22 +1,107 @@
 import aiohttp
-import async_timeout
+import asyncio
 import os
 import zipfile
 import json
+import logging
 import sqlite3
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 import pydest
-from pydest.dbase import DBase
+from pydest.dbase import ConnectionPool
+from pydest.index import build_index, index_file, query_fields, search_names
+from pydest.shared import lock_file, read_version_file, unlock_file, version_file, write_version_file
+from pydest.snapshot import Snapshot, export_snapshot, snapshot_file
 
 MANIFEST_ZIP = 'manifest_zip'
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+DOWNLOAD_IDLE_TIMEOUT = 60
+REFRESH_RETRY_INTERVAL = 60
+
+log = logging.getLogger(__name__)
 
 
 class Manifest:
 
-    def __init__(self, api):
+    def __init__(self, api, cache=None, executor_workers=None, preload_definitions=None, version_ttl=0,
+                 download_chunk_size=DOWNLOAD_CHUNK_SIZE, download_timeout=None,
+                 download_idle_timeout=DOWNLOAD_IDLE_TIMEOUT, download_progress=None, manifest_dir='.',
+                 index_definitions=None, index_fields=None, snapshot_definitions=None, mmap_size=0, shared=False):
+        """
+        Args:
+            api (pydest.API):
+                API used to retrieve the manifest from Bungie.net
+            cache (pydest.cache.LRUCache) [optional]:
+                Cache to keep decoded definitions in, keyed by (language, definition, hash)
+            executor_workers (int) [optional]:
+                Run database queries and json decoding on a dedicated pool of this many
+                threads instead of on the event loop
+            preload_definitions (list) [optional]:
+                Definitions to load entirely into memory whenever a manifest is installed
+            version_ttl (float) [optional]:
+                Seconds for which the manifest version retrieved from Bungie.net is
+                trusted before update_manifest checks for a new one
+            download_chunk_size (int) [optional]:
+                Number of bytes read from the network at a time when downloading a manifest
+            download_timeout (float) [optional]:
+                Maximum number of seconds a manifest download may take, unlimited by default
+            download_idle_timeout (float) [optional]:
+                Maximum number of seconds to wait for more data during a manifest download
+            download_progress (callable) [optional]:
+                Called with the number of bytes downloaded so far and the total size of
+                the download (or None if unknown) after each chunk of a manifest download
+            manifest_dir (str) [optional]:
+                Directory in which manifest files are stored, the current directory by default
+            index_definitions (list) [optional]:
+                Definitions whose names are indexed for search_definitions whenever a
+                manifest is installed
+            index_fields (dict) [optional]:
+                JSON paths indexed for query_hashes and query_definitions whenever a manifest
+                is installed, keyed by definition (ex. {'DestinyInventoryItemDefinition': ['itemType']})
+            snapshot_definitions (list) [optional]:
+                Definitions exported to a memory-mapped binary snapshot whenever a manifest
+                is installed, and served from it instead of from the database
+            mmap_size (int) [optional]:
+                Read manifest databases through a memory map of up to this many bytes,
+                opening them as immutable, so that processes share their pages
+            shared (bool) [optional]:
+                Coordinate updates with the other processes using manifest_dir through a
+                version file per language, so that a manifest is only checked for and
+                downloaded by one of them and then adopted by the others
+        """
         self.api = api
+        self.cache = cache
         self.manifest_files = {'en': '', 'fr': '', 'es': '', 'de': '', 'it': '', 'ja': '', 'pt-br': '', 'es-mx': '',
                                'ru': '', 'pl': '', 'zh-cht': ''}
+        self._pools = {}
+        self._updates = {}
+        self._refresh_task = None
+        self._ready = None
+        self._version_info = {}
+        self.version_ttl = version_ttl
+        self._tables = {}
+        self._table_sizes = {}
+        self.preload_definitions = list(preload_definitions or [])
+        self.download_chunk_size = download_chunk_size
+        self.download_timeout = download_timeout
+        self.download_idle_timeout = download_idle_timeout
+        self.download_progress = download_progress
+        self.manifest_dir = manifest_dir
+        self.index_definitions = list(index_definitions or [])
+        self.index_fields = {definition: list(paths) for definition, paths in (index_fields or {}).items()}
+        self._index_pools = {}
+        self.snapshot_definitions = list(snapshot_definitions or [])
+        self._snapshots = {}
+        self.mmap_size = mmap_size
+        self.shared = shared
+        self._executor = None
+        if executor_workers is not None:
+            self._executor = ThreadPoolExecutor(max_workers=executor_workers,
+                                                thread_name_prefix='pydest-manifest')
 
     async def decode_hash(self, hash_id, definition, language):
         """Get the corresponding static info for an item given it's hash value
@@ -36,34 +121,155 @@ class Manifest:
         if language not in self.manifest_files.keys():
             raise pydest.PydestException("Unsupported language: {}".format(language))
 
-        if self.manifest_files.get(language) == '':
+        if self.manifest_files.get(language) == '' and not self._in_snapshot(language, definition):
             await self.update_manifest(language)
 
-        # Identifier is different for the DestinyHistorialStatsDefinition table
-        if definition == 'DestinyHistoricalStatsDefinition':
-            hash_id = '"{}"'.format(hash_id)
-            identifier = 'key'
+        row_id = self._row_id(hash_id, definition)
+        found = await self._lookup(language, definition, [row_id])
+        if row_id in found:
+            return found[row_id]
         else:
-            hash_id = self._twos_comp_32(hash_id)
-            identifier = "id"
+            raise pydest.PydestException("No entry found with id: {}".format(hash_id))
 
-        with DBase(self.manifest_files.get(language)) as db:
-            try:
-                res = db.query(hash_id, definition, identifier)
-            except sqlite3.OperationalError as e:
-                if e.args[0].startswith('no such table'):
-                    raise pydest.PydestException("Invalid definition: {}".format(definition))
-                else:
-                    raise e
+    async def decode_hashes(self, hash_ids, definition, language):
+        """Get the static info for several entities of the same definition at once
 
-            if len(res) > 0:
-                return json.loads(res[0][0])
-            else:
-                raise pydest.PydestException("No entry found with id: {}".format(hash_id))
+        Args:
+            hash_ids:
+                An iterable of unique identifiers of the entities to decode
+            definition:
+                The type of entity to be decoded (ex. 'DestinyClassDefinition')
+
+        Returns:
+            dict: json corresponding to each given hash_id, keyed by hash_id.
+                Hashes with no entry in the manifest map to None.
+
+        Raises:
+            PydestException
+        """
+        if language not in self.manifest_files.keys():
+            raise pydest.PydestException("Unsupported language: {}".format(language))
+
+        if self.manifest_files.get(language) == '' and not self._in_snapshot(language, definition):
+            await self.update_manifest(language)
+
+        # Several requested hashes may refer to the same row (ex. 123 and '123')
+        requested = {}
+        for hash_id in hash_ids:
+            requested.setdefault(self._row_id(hash_id, definition), []).append(hash_id)
+
+        found = await self._lookup(language, definition, list(requested))
+
+        results = {hash_id: None for ids in requested.values() for hash_id in ids}
+        for row_id, decoded in found.items():
+            for hash_id in requested[row_id]:
+                results[hash_id] = decoded
+        return results
+
+    async def search_definitions(self, term, definition, language, limit=10, fuzzy=True):
+        """Find definitions by name, using the search index of the manifest
+
+        Every word of the term is matched as a prefix of a word in the name or
+        description of the entity, with name matches ranked first. When nothing
+        matches and fuzzy is true, misspelled words are replaced by the closest
+        indexed words.
+
+        Args:
+            term:
+                The search term (ex. 'ace of spa')
+            definition:
+                The type of entity to search, which must be in index_definitions
+            language:
+                The language of the manifest to search
+            limit [optional]:
+                Maximum number of results
+            fuzzy [optional]:
+                Fall back to approximate matching when nothing matches exactly
+
+        Returns:
+            list: json of the matching entities, best match first
+
+        Raises:
+            PydestException
+        """
+        if language not in self.manifest_files.keys():
+            raise pydest.PydestException("Unsupported language: {}".format(language))
+        if definition not in self.index_definitions:
+            raise pydest.PydestException("Definition is not indexed: {}".format(definition))
+
+        if self.manifest_files.get(language) == '':
+            await self.update_manifest(language)
+
+        pool = await self._index_pool(language)
+        with pool.reading():
+            row_ids = await self._run(self._search, pool, term, definition, limit, fuzzy)
+        found = await self._lookup(language, definition, row_ids)
+        return [found[row_id] for row_id in row_ids if row_id in found]
+
+    async def query_hashes(self, definition, filters, language):
+        """Find the hashes of the entities whose indexed fields have the given values
+
+        The filters are answered from the index of the manifest, without reading the
+        definition table.
+
+        Args:
+            definition:
+                The type of entity to query (ex. 'DestinyInventoryItemDefinition')
+            filters:
+                A dict of the value required at each JSON path, or of a list of accepted
+                values (ex. {'itemType': 3, 'inventory.tierType': 6}). Every path must be
+                in index_fields for the definition.
+            language:
+                The language of the manifest to query
+
+        Returns:
+            list: the matching hashes, in ascending order of their table identifiers
+
+        Raises:
+            PydestException
+        """
+        if language not in self.manifest_files.keys():
+            raise pydest.PydestException("Unsupported language: {}".format(language))
+        if not filters:
+            raise pydest.PydestException("No filters given")
+        for path in filters:
+            if path not in self.index_fields.get(definition, []):
+                raise pydest.PydestException("Field is not indexed: {}.{}".format(definition, path))
+
+        if self.manifest_files.get(language) == '':
+            await self.update_manifest(language)
+
+        pool = await self._index_pool(language)
+        with pool.reading():
+            row_ids = await self._run(self._query_fields, pool, definition, filters)
+        return [self._hash(row_id, definition) for row_id in row_ids]
+
+    async def query_definitions(self, definition, filters, language):
+        """Find the entities whose indexed fields have the given values
+
+        Args:
+            definition:
+                The type of entity to query (ex. 'DestinyInventoryItemDefinition')
+            filters:
+                The value, or list of accepted values, required at each indexed JSON path
+            language:
+                The language of the manifest to query
+
+        Returns:
+            dict: json of each matching entity, keyed by hash
+
+        Raises:
+            PydestException
+        """
+        hashes = await self.query_hashes(definition, filters, language)
+        return await self.decode_hashes(hashes, definition, language)
 
     async def update_manifest(self, language):
         """Download the latest manifest file for the given language if necessary
 
+        Only one update runs per language at a time. Calls made while an update
+        is in progress wait for it and share its result, including any failure.
+
         Args:
             language:
                 The language corresponding to the manifest to update
@@ -74,48 +280,675 @@ class Manifest:
         if language not in self.manifest_files.keys():
             raise pydest.PydestException("Unsupported language: {}".format(language))
 
-        json = await self.api.get_destiny_manifest()
-        if json['ErrorCode'] != 1:
+        update = self._updates.get(language)
+        if update is None:
+            update = asyncio.ensure_future(self._update_manifest(language))
+            self._updates[language] = update
+            update.add_done_callback(lambda f: self._forget_update(language, f))
+        # A cancelled waiter must not cancel the update shared with the others
+        await asyncio.shield(update)
+
+    @property
+    def version(self):
+        """The version of the manifest last reported by Bungie.net, or None"""
+        return self._version_info.get('version')
+
+    async def _content_paths(self):
+        """Get the paths of the manifest databases for every language
+
+        The manifest metadata is only requested from Bungie.net once the version
+        TTL has expired, and then with conditional headers so that an unchanged
+        manifest costs a 304 response instead of a full one.
+
+        Returns:
+            dict: path of the manifest database keyed by language
+
+        Raises:
+            PydestException
+        """
+        info = self._version_info
+        now = time.monotonic()
+        if 'paths' in info and now - info['checked_at'] < self.version_ttl:
+            return info['paths']
+
+        json_res, headers = await self.api.get_destiny_manifest_if_modified(
+            etag=info.get('etag'), last_modified=info.get('last_modified'))
+        if json_res is None and 'paths' in info:
+            info['checked_at'] = now
+            return info['paths']
+        if json_res is None or json_res['ErrorCode'] != 1:
             raise pydest.PydestException("Could not retrieve Manifest from Bungie.net")
 
-        manifest_url = 'https://www.bungie.net' + json['Response']['mobileWorldContentPaths'][language]
-        manifest_file_name = manifest_url.split('/')[-1]
+        self._version_info = {
+            'version': json_res['Response']['version'],
+            'paths': json_res['Response']['mobileWorldContentPaths'],
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'checked_at': now,
+        }
+        return self._version_info['paths']
+
+    def _forget_update(self, language, update):
+        """Allow new updates once an update has finished"""
+        if self._updates.get(language) is update:
+            del self._updates[language]
+
+    async def _update_manifest(self, language):
+        """Download and install the latest manifest file for the given language
+
+        The new manifest is downloaded, verified and preloaded before any lookup is
+        switched over to it, so lookups keep being served from the previous manifest
+        until then. The previous manifest file is removed once its last lookup is done,
+        or once a newer manifest is installed when it is shared with other processes.
+
+        Failing to preload a table or to build the index or snapshot of the manifest
+        (ex. because of a misspelled definition) is logged, and the manifest is
+        installed without it.
+        """
+        if self.shared:
+            manifest_file_name = await self._fetch_shared_manifest(language)
+        else:
+            manifest_file_name = await self._fetch_manifest(language)
+
+        if self.manifest_files[language] == manifest_file_name:
+            return
+
+        snapshot = await self._prepare_sidecars(manifest_file_name)
+
+        pool = ConnectionPool(manifest_file_name, self.mmap_size)
+        tables = {}
+        if self.preload_definitions:
+            tables = await self._load_tables(pool, self.preload_definitions, skip_failed=True)
+
+        self.manifest_files[language] = manifest_file_name
+        self._swap_pool(language, manifest_file_name, pool=pool, tables=tables, remove_old=not self.shared)
+        if self.snapshot_definitions:
+            self._set_snapshot(language, snapshot)
+        else:
+            # A snapshot installed with load_snapshot is only kept if it belongs to this manifest
+            loaded = self._snapshots.get(language)
+            if loaded is not None and loaded.manifest != os.path.basename(manifest_file_name):
+                log.warning("Dropping Manifest snapshot %s exported from %s, which was replaced by %s",
+                            loaded.path, loaded.manifest, manifest_file_name)
+                self._set_snapshot(language, None)
+
+    async def _fetch_manifest(self, language):
+        """Download the latest manifest file for the given language unless it is already there
+
+        Returns:
+            str: path of the manifest file
+
+        Raises:
+            PydestException
+        """
+        content_paths = await self._content_paths()
+        manifest_url = 'https://www.bungie.net' + content_paths[language]
+        manifest_file_name = os.path.normpath(os.path.join(self.manifest_dir, manifest_url.split('/')[-1]))
 
         if not os.path.isfile(manifest_file_name):
             # Manifest doesn't exist, or isn't up to date
-            # Download and extract the current manifest
-            # Remove the zip file once finished
-            filename = './{}'.format(MANIFEST_ZIP)
+            await self._install(manifest_url, manifest_file_name)
+        return manifest_file_name
+
+    async def _fetch_shared_manifest(self, language):
+        """Get the manifest file for the given language recorded in its version file
+
+        The version file is locked while it is read and updated, so only one process
+        at a time checks for a new manifest version. When another process did so less
+        than version_ttl seconds ago, its manifest file is adopted as is. Otherwise the
+        latest manifest is retrieved and recorded in the version file, and the manifest
+        file it replaced two versions ago is removed, leaving the other processes a
+        whole version to switch over.
+
+        Returns:
+            str: path of the manifest file
+
+        Raises:
+            PydestException
+        """
+        path = version_file(self.manifest_dir, language)
+        loop = asyncio.get_event_loop()
+        locking = loop.run_in_executor(None, lock_file, path + '.lock')
+        try:
+            lock = await asyncio.shield(locking)
+        except asyncio.CancelledError:
+            # The lock is still taken once the thread waiting for it gets it
+            locking.add_done_callback(lambda f: f.exception() is None and unlock_file(f.result()))
+            raise
+        try:
+            info = read_version_file(path)
+            manifest_file_name = os.path.normpath(os.path.join(self.manifest_dir, info.get('file', '')))
+            if (info.get('file') and time.time() - info['checked_at'] < self.version_ttl and
+                    os.path.isfile(manifest_file_name)):
+                return manifest_file_name
+
+            manifest_file_name = await self._fetch_manifest(language)
+            # Build the sidecars before recording the manifest, so the other processes find them ready
+            snapshot = await self._prepare_sidecars(manifest_file_name)
+            if snapshot is not None:
+                snapshot.close()
+
+            name = os.path.basename(manifest_file_name)
+            previous = info.get('previous')
+            if info.get('file') and info['file'] != name:
+                previous, stale = info['file'], info.get('previous')
+                if stale and stale != name:
+                    self._remove_manifest_file(os.path.normpath(os.path.join(self.manifest_dir, stale)))
+            write_version_file(path, {'file': name, 'previous': previous, 'checked_at': time.time()})
+            return manifest_file_name
+        finally:
+            unlock_file(lock)
+
+    async def _prepare_sidecars(self, manifest_file_name):
+        """Build the index and snapshot of a manifest file, logging any failure
+
+        Returns:
+            pydest.snapshot.Snapshot: the opened snapshot, or None if there is none
+        """
+        if self.index_definitions or self.index_fields:
+            try:
+                await self._build_index(manifest_file_name)
+            except Exception as e:
+                log.warning("Could not build the index of %s: %s", manifest_file_name, e)
+        if self.snapshot_definitions:
+            try:
+                return await self._open_snapshot(manifest_file_name)
+            except Exception as e:
+                log.warning("Could not export the snapshot of %s: %s", manifest_file_name, e)
+        return None
+
+    async def _install(self, manifest_url, manifest_file_name):
+        """Download, extract and verify a manifest in a staging directory, then move it into place
+
+        Raises:
+            PydestException
+        """
+        staging_dir = tempfile.mkdtemp(prefix='.pydest-', dir=self.manifest_dir)
+        try:
+            filename = os.path.join(staging_dir, MANIFEST_ZIP)
+            staged_file = os.path.join(staging_dir, os.path.basename(manifest_file_name))
             await self._download_file(manifest_url, filename)
-            if os.path.isfile(filename):
-                zip_ref = zipfile.ZipFile(filename, 'r')
-                zip_ref.extractall('./')
-                zip_ref.close()
-                os.remove(filename)
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, self._unpack, filename, staged_file)
+            os.replace(staged_file, manifest_file_name)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    async def preload(self, definitions, language):
+        """Load entire definition tables into memory
+
+        Lookups in a preloaded table no longer touch the database. The tables are
+        loaded concurrently off the event loop, and are dropped again whenever the
+        manifest for the language changes.
+
+        Args:
+            definitions:
+                The definitions to load (ex. ['DestinyClassDefinition'])
+            language:
+                The language of the manifest to load the definitions from
+
+        Raises:
+            PydestException
+        """
+        if language not in self.manifest_files.keys():
+            raise pydest.PydestException("Unsupported language: {}".format(language))
+
+        if self.manifest_files.get(language) == '':
+            await self.update_manifest(language)
+
+        pool = self._pool(language)
+        tables = await self._load_tables(pool, definitions)
+
+        # Drop the results if the manifest was swapped while they were loading
+        if self._pools.get(language) is not pool:
+            return
+        for definition, (table, size) in tables.items():
+            self._tables.setdefault(language, {})[definition] = table
+            self._table_sizes[(language, definition)] = size
+
+    async def load_snapshot(self, path, language):
+        """Serve lookups for a language from a snapshot written by pydest.snapshot.export_snapshot
+
+        Opening a snapshot is nearly instant, as it is memory-mapped rather than read,
+        and no manifest database is needed for the definitions it contains. Other
+        definitions are still looked up in the manifest database. The snapshot is
+        dropped once a manifest other than the one it was exported from is installed.
+
+        Args:
+            path:
+                Path of the snapshot, for example the one written next to a manifest
+                installed with snapshot_definitions
+            language:
+                The language of the manifest the snapshot was exported from
+
+        Raises:
+            PydestException
+        """
+        if language not in self.manifest_files.keys():
+            raise pydest.PydestException("Unsupported language: {}".format(language))
+        try:
+            snapshot = Snapshot(path)
+        except (OSError, ValueError) as e:
+            raise pydest.PydestException("Could not load Manifest snapshot: {}".format(e))
+        self._set_snapshot(language, snapshot)
+
+    def preloaded_memory(self):
+        """Get the approximate memory used by preloaded tables
+
+        Returns:
+            dict: size of the json of each preloaded table in bytes, keyed by (language, definition)
+        """
+        return dict(self._table_sizes)
+
+    def start_refresh(self, languages=('en',), interval=3600):
+        """Start keeping the manifests of the given languages up to date in the background
+
+        The manifests are installed straight away, after which Bungie.net is polled
+        for a new manifest version every interval seconds. Checks are subject to
+        version_ttl, so interval should not be shorter than it.
+
+        Args:
+            languages [optional]:
+                The languages whose manifests should be kept up to date
+            interval [optional]:
+                Number of seconds between checks for a new manifest version
+
+        Raises:
+            PydestException
+        """
+        for language in languages:
+            if language not in self.manifest_files.keys():
+                raise pydest.PydestException("Unsupported language: {}".format(language))
+        if self._refresh_task is not None:
+            raise pydest.PydestException("Manifest refresh is already running")
+        self._ready = asyncio.Event()
+        self._refresh_task = asyncio.ensure_future(self._refresh(list(languages), interval))
+
+    async def wait_ready(self):
+        """Wait until every manifest passed to start_refresh has been installed"""
+        if self._ready is None:
+            raise pydest.PydestException("Manifest refresh has not been started")
+        await self._ready.wait()
+
+    async def stop_refresh(self):
+        """Stop the background refresh started by start_refresh"""
+        task, self._refresh_task = self._refresh_task, None
+        if task is None:
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            log.exception("Manifest refresh had failed")
+
+    async def _refresh(self, languages, interval):
+        """Install the manifests for the given languages, then poll for new versions forever
+
+        Any failure, including Bungie.net being down for maintenance, is logged and
+        the manifests are checked again later.
+        """
+        while True:
+            try:
+                await asyncio.gather(*[self.update_manifest(language) for language in languages])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning("Could not refresh Manifest: %r", e)
             else:
-                raise pydest.PydestException("Could not retrieve Manifest from Bungie.net")
+                self._ready.set()
+            await asyncio.sleep(interval if self._ready.is_set() else min(interval, REFRESH_RETRY_INTERVAL))
 
-        self.manifest_files[language] = manifest_file_name
+    def close(self):
+        """Stop the manifest executor and close all pooled manifest connections"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        pools, self._pools = self._pools, {}
+        index_pools, self._index_pools = self._index_pools, {}
+        for pool in list(pools.values()) + list(index_pools.values()):
+            pool.close()
+        snapshots, self._snapshots = self._snapshots, {}
+        for snapshot in snapshots.values():
+            snapshot.close()
+
+    def _pool(self, language):
+        """Get the connection pool for the current manifest of a language"""
+        pool = self._pools.get(language)
+        if pool is None or pool.db_file != self.manifest_files[language]:
+            self._swap_pool(language, self.manifest_files[language])
+            pool = self._pools[language]
+        return pool
+
+    def _swap_pool(self, language, manifest_file_name, pool=None, tables=None, remove_old=False):
+        """Point a language at a new manifest file, retiring the previous pool
+
+        Args:
+            language:
+                The language whose manifest changed
+            manifest_file_name:
+                The new manifest file
+            pool [optional]:
+                A pool already opened on the new manifest file
+            tables [optional]:
+                Tables preloaded from the new manifest file, as returned by _load_tables
+            remove_old [optional]:
+                Remove the previous manifest file once its last reader is done
+        """
+        old_pool = self._pools.get(language)
+        if old_pool is not None and old_pool.db_file == manifest_file_name:
+            return
+        self._pools[language] = pool or ConnectionPool(manifest_file_name, self.mmap_size)
+        for definition in self._tables.pop(language, {}):
+            del self._table_sizes[(language, definition)]
+        for definition, (table, size) in (tables or {}).items():
+            self._tables.setdefault(language, {})[definition] = table
+            self._table_sizes[(language, definition)] = size
+        if self.cache is not None:
+            self.cache.invalidate(lambda key: key[0] == language)
+        if old_pool is not None:
+            old_pool.retire(self._remove_manifest_file if remove_old else None)
+
+    def _remove_manifest_file(self, manifest_file_name):
+        """Remove a manifest file that is no longer used by any language, along with its sidecars"""
+        if manifest_file_name in self.manifest_files.values():
+            return
+        for name in (manifest_file_name, index_file(manifest_file_name), snapshot_file(manifest_file_name)):
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+
+    async def _index_pool(self, language):
+        """Get the connection pool for the index of the current manifest of a language, building it if needed"""
+        manifest_file_name = self.manifest_files[language]
+        pool = self._index_pools.get(language)
+        if pool is not None and pool.db_file == index_file(manifest_file_name):
+            return pool
+        await self._build_index(manifest_file_name)
+
+        # Another search may have opened the index while it was being built
+        pool = self._index_pools.get(language)
+        if pool is not None and pool.db_file == index_file(manifest_file_name):
+            return pool
+        self._index_pools[language] = ConnectionPool(index_file(manifest_file_name), self.mmap_size)
+        if pool is not None:
+            pool.retire()
+        return self._index_pools[language]
+
+    async def _build_index(self, manifest_file_name):
+        """Build the index of a manifest file off the event loop, unless it is already up to date
+
+        Raises:
+            PydestException
+        """
+        identifiers = {definition: self._identifier(definition)
+                       for definition in self.index_definitions + list(self.index_fields)}
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(self._executor, partial(build_index, manifest_file_name, identifiers,
+                                                               self.index_definitions, self.index_fields))
+        except sqlite3.OperationalError as e:
+            if e.args[0].startswith('no such table'):
+                raise pydest.PydestException("Invalid definition: {}".format(e.args[0].split('.')[-1]))
+            else:
+                raise e
+
+    async def _open_snapshot(self, manifest_file_name):
+        """Open the snapshot of a manifest file, exporting it off the event loop first if needed
+
+        Raises:
+            PydestException
+        """
+        path = snapshot_file(manifest_file_name)
+        try:
+            snapshot = Snapshot(path)
+        except (OSError, ValueError):
+            snapshot = None
+        if snapshot is not None:
+            if sorted(snapshot.definitions) == sorted(self.snapshot_definitions):
+                return snapshot
+            snapshot.close()
+
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(self._executor, partial(export_snapshot, manifest_file_name, path,
+                                                               self.snapshot_definitions))
+        except sqlite3.OperationalError as e:
+            raise pydest.PydestException("Could not export Manifest snapshot: {}".format(e))
+        return Snapshot(path)
+
+    def _set_snapshot(self, language, snapshot):
+        """Replace the snapshot serving a language, or stop serving it from a snapshot if snapshot is None"""
+        old_snapshot = self._snapshots.pop(language, None)
+        if snapshot is not None:
+            self._snapshots[language] = snapshot
+        if old_snapshot is None and snapshot is None:
+            return
+        if self.cache is not None:
+            self.cache.invalidate(lambda key: key[0] == language)
+        if old_snapshot is not None:
+            old_snapshot.close()
+
+    def _in_snapshot(self, language, definition):
+        """Check whether lookups of a definition are served from a snapshot"""
+        snapshot = self._snapshots.get(language)
+        return snapshot is not None and definition in snapshot
+
+    def _search(self, pool, term, definition, limit, fuzzy):
+        """Search the index of a manifest, run on the manifest executor when one is configured"""
+        return search_names(pool.connection(), term, definition, limit, fuzzy)
+
+    def _query_fields(self, pool, definition, filters):
+        """Query the index of a manifest, run on the manifest executor when one is configured"""
+        return query_fields(pool.connection(), definition, filters)
 
     async def _download_file(self, url, name):
         """Async file download
 
+        The response is streamed to disk in large chunks, with the writes done off
+        the event loop. The download fails if it takes longer than download_timeout,
+        or if no data is received for download_idle_timeout seconds.
+
         Args:
             url (str):
                 The URL from which to download the file
             name (str):
                 The name to give to the downloaded file
+
+        Raises:
+            PydestException
         """
-        with async_timeout.timeout(10):
-            async with self.api.session.get(url) as response:
-                filename = os.path.basename(name)
-                with open(filename, 'wb') as f_handle:
+        loop = asyncio.get_event_loop()
+        timeout = aiohttp.ClientTimeout(total=self.download_timeout, sock_read=self.download_idle_timeout)
+        try:
+            async with self.api.session.get(url, timeout=timeout) as response:
+                if response.status != 200:
+                    raise pydest.PydestException("Could not retrieve Manifest from Bungie.net")
+                total = response.content_length
+                downloaded = 0
+                with open(name, 'wb') as f_handle:
                     while True:
-                        chunk = await response.content.read(1024)
+                        chunk = await response.content.read(self.download_chunk_size)
                         if not chunk:
                             break
-                        f_handle.write(chunk)
-                return await response.release()
+                        await loop.run_in_executor(None, f_handle.write, chunk)
+                        downloaded += len(chunk)
+                        if self.download_progress is not None:
+                            self.download_progress(downloaded, total)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            raise pydest.PydestException("Could not retrieve Manifest from Bungie.net")
+
+    def _unpack(self, filename, staged_file):
+        """Extract a downloaded manifest archive and verify the database, run off the event loop
+
+        Raises:
+            PydestException
+        """
+        try:
+            with zipfile.ZipFile(filename, 'r') as zip_ref:
+                zip_ref.extractall(os.path.dirname(staged_file))
+        except zipfile.BadZipFile:
+            raise pydest.PydestException("Could not retrieve Manifest from Bungie.net")
+        if not os.path.isfile(staged_file):
+            raise pydest.PydestException("Could not retrieve Manifest from Bungie.net")
+
+        pool = ConnectionPool(staged_file)
+        try:
+            with pool.db() as db:
+                check = db.cur.execute('PRAGMA quick_check').fetchone()
+                tables = db.cur.execute("SELECT count(*) FROM sqlite_master WHERE type = 'table'").fetchone()
+        except sqlite3.DatabaseError:
+            check, tables = None, None
+        finally:
+            pool.close()
+        if check != ('ok',) or not tables or tables[0] == 0:
+            raise pydest.PydestException("Downloaded Manifest is corrupt")
+
+    async def _lookup(self, language, definition, row_ids):
+        """Resolve table identifiers to definitions, using the cache where possible
+
+        Returns:
+            dict: decoded json keyed by identifier, for every identifier that was found
+        """
+        if self._in_snapshot(language, definition):
+            return self._lookup_snapshot(language, definition, row_ids)
+
+        # Switching pools invalidates the cache, so it has to happen before any cache lookup
+        pool = self._pool(language)
+        table = self._tables.get(language, {}).get(definition)
+        if table is not None:
+            return {row_id: table[row_id] for row_id in row_ids if row_id in table}
+
+        found = {}
+        missing = row_ids
+        if self.cache is not None:
+            missing = []
+            for row_id in row_ids:
+                decoded = self.cache.get((language, definition, row_id))
+                if decoded is None:
+                    missing.append(row_id)
+                else:
+                    found[row_id] = decoded
+            if not missing:
+                return found
+
+        with pool.reading():
+            rows = await self._run(self._query, pool, definition, missing)
+        for row_id, decoded, size in rows:
+            if self.cache is not None:
+                self.cache.put((language, definition, row_id), decoded, size=size)
+            found[row_id] = decoded
+        return found
+
+    def _lookup_snapshot(self, language, definition, row_ids):
+        """Resolve table identifiers to definitions from a snapshot, using the cache where possible
+
+        Reading from the memory map never blocks for long, so this runs on the event loop,
+        which also guarantees the snapshot isn't closed while it is being read.
+        """
+        snapshot = self._snapshots[language]
+        found = {}
+        for row_id in row_ids:
+            if self.cache is not None:
+                decoded = self.cache.get((language, definition, row_id))
+                if decoded is not None:
+                    found[row_id] = decoded
+                    continue
+            data = snapshot.get(definition, row_id)
+            if data is None:
+                continue
+            found[row_id] = json.loads(data)
+            if self.cache is not None:
+                self.cache.put((language, definition, row_id), found[row_id], size=len(data))
+        return found
+
+    def _query(self, pool, definition, row_ids):
+        """Query and decode definitions from the manifest database
+
+        This is run on the manifest executor when one is configured.
+
+        Returns:
+            list: (identifier, decoded json, size of the json in bytes) for each entry found
+        """
+        with pool.db() as db:
+            try:
+                rows = db.query_many(row_ids, definition, self._identifier(definition))
+            except sqlite3.OperationalError as e:
+                if e.args[0].startswith('no such table'):
+                    raise pydest.PydestException("Invalid definition: {}".format(definition))
+                else:
+                    raise e
+        return [(row_id, json.loads(data), len(data)) for row_id, data in rows]
+
+    async def _load_tables(self, pool, definitions, skip_failed=False):
+        """Load several definition tables concurrently off the event loop
+
+        Args:
+            skip_failed [optional]:
+                Log and leave out the tables which fail to load instead of raising
+
+        Returns:
+            dict: (decoded json keyed by identifier, size in bytes) keyed by definition
+        """
+        loop = asyncio.get_event_loop()
+        with pool.reading():
+            tables = await asyncio.gather(*[
+                loop.run_in_executor(self._executor, partial(self._query_table, pool, definition))
+                for definition in definitions
+            ], return_exceptions=True)
+        loaded = {}
+        for definition, table in zip(definitions, tables):
+            if isinstance(table, Exception):
+                if not skip_failed:
+                    raise table
+                log.warning("Could not preload %s from %s: %s", definition, pool.db_file, table)
+            else:
+                loaded[definition] = table
+        return loaded
+
+    def _query_table(self, pool, definition):
+        """Query and decode every definition in a table
+
+        Returns:
+            tuple: (decoded json keyed by identifier, size of the json in bytes)
+        """
+        with pool.db() as db:
+            try:
+                rows = db.query_all(definition, self._identifier(definition))
+            except sqlite3.OperationalError as e:
+                if e.args[0].startswith('no such table'):
+                    raise pydest.PydestException("Invalid definition: {}".format(definition))
+                else:
+                    raise e
+        return {row_id: json.loads(data) for row_id, data in rows}, sum(len(data) for _, data in rows)
+
+    async def _run(self, func, *args):
+        """Run a blocking manifest function, on the manifest executor if there is one"""
+        if self._executor is None:
+            return func(*args)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args))
+
+    def _identifier(self, definition):
+        """Get the column identifying the entries of a definition table"""
+        # Identifier is different for the DestinyHistorialStatsDefinition table
+        if definition == 'DestinyHistoricalStatsDefinition':
+            return 'key'
+        return 'id'
+
+    def _row_id(self, hash_id, definition):
+        """Convert a hash to the value stored in the identifier column of its table"""
+        if definition == 'DestinyHistoricalStatsDefinition':
+            return str(hash_id)
+        return self._twos_comp_32(hash_id)
+
+    def _hash(self, row_id, definition):
+        """Convert the value stored in the identifier column of a table back to a hash"""
+        if definition == 'DestinyHistoricalStatsDefinition':
+            return row_id
+        return row_id & 0xFFFFFFFF
 
     def _twos_comp_32(self, val):
         val = int(val)
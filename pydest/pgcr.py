@@ -0,0 +1,101 @@
+import json
+import sqlite3
+import threading
+import zlib
+
+
+class PGCRStore:
+    """A permanent on-disk store of Post Game Carnage Reports
+
+    A PGCR never changes once the activity is over, so reports are kept forever,
+    compressed and indexed by activity id in an SQLite database. The store may be
+    used from several threads.
+    """
+
+    def __init__(self, db_file):
+        """
+        Args:
+            db_file (str):
+                Path of the SQLite database holding the reports, created if needed
+        """
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("""
+                               CREATE TABLE IF NOT EXISTS pgcr
+                               (activity_id INTEGER PRIMARY KEY, data BLOB)
+                               """)
+            self._conn.commit()
+
+    def __contains__(self, activity_id):
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM pgcr WHERE activity_id = ?", (int(activity_id),)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT count(*) FROM pgcr").fetchone()[0]
+
+    def get(self, activity_id):
+        """Get a stored report
+
+        Returns:
+            json (dict), or None if the report isn't stored
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM pgcr WHERE activity_id = ?", (int(activity_id),)).fetchone()
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, activity_id, report):
+        """Store a report, as returned by API.get_post_game_carnage_report"""
+        self.put_many([(activity_id, report)])
+
+    def put_many(self, reports):
+        """Store several (activity_id, report) pairs in a single transaction"""
+        rows = [(int(activity_id), zlib.compress(json.dumps(report).encode()))
+                for activity_id, report in reports]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO pgcr VALUES (?, ?)", rows)
+            self._conn.commit()
+
+    def import_jsonl(self, path, batch_size=1000):
+        """Import reports from a file with one {"activityId": ..., "report": ...} object per line
+
+        Returns:
+            int: the number of reports imported
+        """
+        count = 0
+        batch = []
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                batch.append((entry['activityId'], entry['report']))
+                if len(batch) >= batch_size:
+                    self.put_many(batch)
+                    count += len(batch)
+                    batch = []
+        self.put_many(batch)
+        return count + len(batch)
+
+    def export_jsonl(self, path):
+        """Export every stored report in the format read by import_jsonl
+
+        Returns:
+            int: the number of reports exported
+        """
+        count = 0
+        with self._lock, open(path, 'w') as f:
+            cur = self._conn.execute("SELECT activity_id, data FROM pgcr ORDER BY activity_id")
+            for activity_id, data in cur:
+                report = json.loads(zlib.decompress(data))
+                f.write(json.dumps({'activityId': activity_id, 'report': report}) + '\n')
+                count += 1
+        return count
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -4,12 +4,23 @@ import os
 import zipfile
 
 from pydest.api import API
-from pydest.manifest import Manifest
+from pydest.cache import LRUCache
+from pydest.hydrate import hydrate
+from pydest.manifest import DOWNLOAD_CHUNK_SIZE, DOWNLOAD_IDLE_TIMEOUT, Manifest
+from pydest.ratelimit import RateLimiter
 
 
 class Pydest:
 
-    def __init__(self, api_key, loop=None, client_id=None, client_secret=None):
+    def __init__(self, api_key, loop=None, client_id=None, client_secret=None,
+                 manifest_cache_entries=None, manifest_cache_bytes=None, manifest_workers=None,
+                 manifest_preload=None, manifest_version_ttl=0, manifest_download_chunk_size=DOWNLOAD_CHUNK_SIZE,
+                 manifest_download_timeout=None, manifest_download_idle_timeout=DOWNLOAD_IDLE_TIMEOUT,
+                 manifest_download_progress=None, manifest_dir='.', manifest_index=None,
+                 manifest_index_fields=None, manifest_snapshot=None, manifest_mmap_size=0, manifest_shared=False,
+                 rate_limit=None, rate_burst=None,
+                 retry_policy=None, coalesce_requests=False, response_cache=None, response_cache_ttls=None,
+                 response_cache_authenticated=False, pgcr_store=None):
         """Base class for Pydest
 
         Args:
@@ -21,6 +32,63 @@ class Pydest:
                 Bungie.net application client id
             client_secret (str) [optional]:
                 Bungie.net application client id
+            manifest_cache_entries (int) [optional]:
+                Keep up to this many decoded Manifest definitions in memory
+            manifest_cache_bytes (int) [optional]:
+                Keep up to roughly this many bytes of decoded Manifest definitions in memory
+            manifest_workers (int) [optional]:
+                Run Manifest lookups on a dedicated pool of this many threads, keeping
+                the event loop free while the database is read
+            manifest_preload (list) [optional]:
+                Definitions to load entirely into memory whenever a Manifest is installed
+                (ex. ['DestinyActivityDefinition', 'DestinyClassDefinition'])
+            manifest_version_ttl (float) [optional]:
+                Seconds to wait before update_manifest checks Bungie.net for a new Manifest version again
+            manifest_download_chunk_size (int) [optional]:
+                Number of bytes read from the network at a time when downloading a Manifest
+            manifest_download_timeout (float) [optional]:
+                Maximum number of seconds a Manifest download may take, unlimited by default
+            manifest_download_idle_timeout (float) [optional]:
+                Maximum number of seconds to wait for more data during a Manifest download
+            manifest_download_progress (callable) [optional]:
+                Called with the bytes downloaded so far and the total size (or None) during
+                a Manifest download
+            manifest_dir (str) [optional]:
+                Directory in which Manifest files are stored, the current directory by default
+            manifest_index (list) [optional]:
+                Definitions whose names are indexed for search_definitions whenever a Manifest
+                is installed (ex. ['DestinyInventoryItemDefinition'])
+            manifest_index_fields (dict) [optional]:
+                JSON paths indexed for query_definitions whenever a Manifest is installed,
+                keyed by definition (ex. {'DestinyInventoryItemDefinition': ['itemType', 'inventory.tierType']})
+            manifest_snapshot (list) [optional]:
+                Definitions exported to a memory-mapped binary snapshot whenever a Manifest is
+                installed, and decoded from it instead of from the database
+            manifest_mmap_size (int) [optional]:
+                Read Manifest databases through a memory map of up to this many bytes, which
+                is shared by every process reading the same file
+            manifest_shared (bool) [optional]:
+                Coordinate Manifest updates with the other processes using manifest_dir, so
+                that only one of them checks for and downloads a new Manifest
+            rate_limit (float) [optional]:
+                Maximum average number of requests per second sent to each Bungie.net service
+                (Destiny2, GroupV2, User, ...). Requests are not rate limited by default.
+            rate_burst (int) [optional]:
+                Maximum number of requests sent to a service at once, rate_limit by default
+            retry_policy (pydest.retry.RetryPolicy) [optional]:
+                Policy for retrying requests which failed because of a transient error.
+                Requests are not retried by default.
+            coalesce_requests (bool) [optional]:
+                Send identical GET requests made at the same time to Bungie.net only once
+            response_cache (pydest.cache.MemoryResponseCache or SQLiteResponseCache) [optional]:
+                Cache for the responses of read-only endpoints such as get_public_milestones
+            response_cache_ttls (dict) [optional]:
+                Number of seconds to cache responses for, keyed by API method name
+            response_cache_authenticated (bool) [optional]:
+                Also cache the responses of requests made with an access token, keyed by
+                a hash of the token
+            pgcr_store (pydest.pgcr.PGCRStore) [optional]:
+                Permanent store of Post Game Carnage Reports, so that each one is only retrieved once
         """
         headers = {'X-API-KEY': api_key}
 
@@ -28,8 +96,25 @@ class Pydest:
 
         connector = aiohttp.TCPConnector(limit=25)
         self._session = aiohttp.ClientSession(loop=self._loop, headers=headers, connector=connector)
-        self.api = API(self._session, client_id, client_secret)
-        self._manifest = Manifest(self.api)
+        rate_limiter = None
+        if rate_limit is not None:
+            rate_limiter = RateLimiter(rate_limit, rate_burst)
+        self.api = API(self._session, client_id, client_secret, rate_limiter=rate_limiter,
+                       retry_policy=retry_policy, coalesce_requests=coalesce_requests,
+                       response_cache=response_cache, cache_ttls=response_cache_ttls,
+                       cache_authenticated=response_cache_authenticated, pgcr_store=pgcr_store)
+        cache = None
+        if manifest_cache_entries is not None or manifest_cache_bytes is not None:
+            cache = LRUCache(manifest_cache_entries, manifest_cache_bytes)
+        self._manifest = Manifest(self.api, cache=cache, executor_workers=manifest_workers,
+                                  preload_definitions=manifest_preload, version_ttl=manifest_version_ttl,
+                                  download_chunk_size=manifest_download_chunk_size,
+                                  download_timeout=manifest_download_timeout,
+                                  download_idle_timeout=manifest_download_idle_timeout,
+                                  download_progress=manifest_download_progress, manifest_dir=manifest_dir,
+                                  index_definitions=manifest_index, index_fields=manifest_index_fields,
+                                  snapshot_definitions=manifest_snapshot, mmap_size=manifest_mmap_size,
+                                  shared=manifest_shared)
 
     async def decode_hash(self, hash_id, definition, language='en'):
         """Get the corresponding static info for an item given it's hash value from the Manifest
@@ -50,6 +135,150 @@ class Pydest:
         """
         return await self._manifest.decode_hash(hash_id, definition, language)
 
+    async def decode_hashes(self, hash_ids, definition, language='en'):
+        """Get the static info for several entities of the same type from the Manifest
+
+        All of the hashes are resolved in as few database queries as possible, which is
+        much faster than calling decode_hash once per entity.
+
+        Args:
+            hash_ids (iterable):
+                The unique identifiers of the entities to decode
+            definition (str):
+                The type of entity to be decoded (ex. 'DestinyClassDefinition')
+            language (str):
+                The language to use when retrieving results from the Manifest
+
+        Returns:
+            dict: json (dict) for each hash_id, or None if no entry was found
+
+        Raises:
+            PydestException
+        """
+        return await self._manifest.decode_hashes(hash_ids, definition, language)
+
+    async def search_definitions(self, term, definition, language='en', limit=10, fuzzy=True):
+        """Find entities in the Manifest by name, entirely offline
+
+        Requires the definition to be in manifest_index. Every word of the term is
+        matched as a prefix, and misspelled terms fall back to approximate matching.
+
+        Args:
+            term (str):
+                The search term (ex. 'ace of spa')
+            definition (str):
+                The type of entity to search (ex. 'DestinyInventoryItemDefinition')
+            language (str):
+                The language to use when retrieving results from the Manifest
+            limit (int) [optional]:
+                Maximum number of results
+            fuzzy (bool) [optional]:
+                Fall back to approximate matching when nothing matches exactly
+
+        Returns:
+            list: json (dict) of the matching entities, best match first
+
+        Raises:
+            PydestException
+        """
+        return await self._manifest.search_definitions(term, definition, language, limit, fuzzy)
+
+    async def query_definitions(self, definition, filters, language='en', hashes_only=False):
+        """Find entities in the Manifest by the values of their indexed fields
+
+        Only the index is searched, so no definition table is scanned. Every path in
+        filters must be listed for the definition in manifest_index_fields.
+
+        Args:
+            definition (str):
+                The type of entity to query (ex. 'DestinyInventoryItemDefinition')
+            filters (dict):
+                The value required at each JSON path, or a list of accepted values
+                (ex. {'itemType': 3, 'inventory.tierType': 6})
+            language (str):
+                The language to use when retrieving results from the Manifest
+            hashes_only (bool) [optional]:
+                Return the hashes of the matching entities without decoding them
+
+        Returns:
+            dict: json (dict) of each matching entity keyed by hash, or a list of
+                hashes when hashes_only is true
+
+        Raises:
+            PydestException
+        """
+        if hashes_only:
+            return await self._manifest.query_hashes(definition, filters, language)
+        return await self._manifest.query_definitions(definition, filters, language)
+
+    async def hydrate(self, response, language='en', fields=None, inline=False):
+        """Decode every hash found in an API response (ex. from get_profile) in bulk
+
+        The response is scanned once, its hashes are grouped by definition and each
+        group is resolved with a single batched Manifest lookup.
+
+        Args:
+            response (dict or list):
+                The json returned by an API call
+            language (str):
+                The language to use when retrieving results from the Manifest
+            fields (dict) [optional]:
+                Maps the name of a hash field to the definition it refers to,
+                defaults to pydest.hydrate.HASH_FIELDS
+            inline (bool) [optional]:
+                Also attach each definition next to its hash, under the field name with
+                'Hash' replaced by 'Definition' (ex. itemDefinition). This modifies the
+                response in place.
+
+        Returns:
+            dict: json (dict) of each hash, or None if it isn't in the Manifest,
+                keyed by definition then by hash
+
+        Raises:
+            PydestException
+        """
+        return await hydrate(self._manifest, response, language, fields, inline)
+
+    async def iter_search_destiny_entities(self, entity_type, search_term, language='en', prefetch=2,
+                                           batch_size=100):
+        """Search for Destiny entities, yielding each one along with its decoded definition
+
+        Search results are paged through with API.iter_search_destiny_entities, and their
+        definitions are decoded from the Manifest in batches of batch_size entities.
+
+        Args:
+            entity_type (str):
+                The type of entity - ex. 'DestinyInventoryItemDefinition'
+            search_term (str):
+                The term to search for
+            language (str):
+                The language to use when retrieving results from the Manifest
+            prefetch (int) [optional]:
+                Number of result pages requested ahead of the one being consumed
+            batch_size (int) [optional]:
+                Number of entities whose definitions are decoded at once
+
+        Yields:
+            tuple: (entity (dict), json (dict) of its definition, or None if it isn't in the Manifest)
+        """
+        batch = []
+        async for entity in self.api.iter_search_destiny_entities(entity_type, search_term, prefetch):
+            batch.append(entity)
+            if len(batch) >= batch_size:
+                for result in await self._decode_entities(batch, entity_type, language):
+                    yield result
+                batch = []
+        for result in await self._decode_entities(batch, entity_type, language):
+            yield result
+
+    async def _decode_entities(self, entities, entity_type, language):
+        """Pair search result entities with their decoded definitions"""
+        definitions = {}
+        for definition in {entity.get('entityType') or entity_type for entity in entities}:
+            hashes = [e['hash'] for e in entities if (e.get('entityType') or entity_type) == definition]
+            definitions[definition] = await self.decode_hashes(hashes, definition, language)
+        return [(entity, definitions[entity.get('entityType') or entity_type][entity['hash']]) for entity in entities]
+
     async def update_manifest(self, language='en'):
         """Update the manifest if there is a newer version available
 
@@ -59,8 +288,74 @@ class Pydest:
         """
         await self._manifest.update_manifest(language)
 
+    async def preload_manifest(self, definitions, language='en'):
+        """Load entire Manifest tables into memory, so that decoding them doesn't touch the database
+
+        Args:
+            definitions (list):
+                The types of entity to load (ex. ['DestinyClassDefinition'])
+            language (str):
+                The language to use when retrieving results from the Manifest
+
+        Raises:
+            PydestException
+        """
+        await self._manifest.preload(definitions, language)
+
+    async def load_manifest_snapshot(self, path, language='en'):
+        """Decode hashes from a Manifest snapshot, without downloading or opening the Manifest
+
+        Args:
+            path (str):
+                Path of a snapshot written by pydest.snapshot.export_snapshot, or by
+                a Pydest created with manifest_snapshot
+            language (str):
+                The language of the Manifest the snapshot was exported from
+
+        Raises:
+            PydestException
+        """
+        await self._manifest.load_snapshot(path, language)
+
+    def preloaded_memory(self):
+        """Get the approximate memory used by preloaded Manifest tables
+
+        Returns:
+            dict: size in bytes of each preloaded table, keyed by (language, definition)
+        """
+        return self._manifest.preloaded_memory()
+
+    def start_manifest_refresh(self, languages=('en',), interval=3600):
+        """Keep the Manifest for the given languages up to date in the background
+
+        The Manifests are downloaded straight away, so that the first decode_hash call
+        doesn't have to wait for them. Use manifest_ready to wait until they are installed.
+
+        Args:
+            languages (iterable) [optional]:
+                The languages whose Manifests should be kept up to date
+            interval (float) [optional]:
+                Number of seconds between checks for a new Manifest version
+
+        Raises:
+            PydestException
+        """
+        self._manifest.start_refresh(languages, interval)
+
+    async def manifest_ready(self):
+        """Wait until the Manifests passed to start_manifest_refresh have been installed
+
+        Raises:
+            PydestException
+        """
+        await self._manifest.wait_ready()
+
     async def close(self):
-        await self._session.close()
+        try:
+            await self._manifest.stop_refresh()
+            self._manifest.close()
+        finally:
+            await self._session.close()
 
 
 class PydestException(Exception):
@@ -0,0 +1,123 @@
+import asyncio
+import time
+import urllib.parse
+
+
+class TokenBucket:
+    """An async token bucket allowing a sustained rate of requests with bursts
+
+    Requests wait in the order they arrive. The bucket can be paused, which is
+    used to back off when Bungie.net asks clients to slow down.
+    """
+
+    def __init__(self, rate, burst):
+        """
+        Args:
+            rate (float):
+                Number of requests allowed per second on average
+            burst (int):
+                Maximum number of requests allowed at once after a quiet period
+        """
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Wait until a request may be sent
+
+        Returns:
+            float: the number of seconds spent waiting
+        """
+        start = time.monotonic()
+        # Requests queued behind another waiting request have to wait as well
+        waited = self._lock.locked()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    waited = True
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return now - start if waited else 0.0
+                waited = True
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Hold back every request for the given number of seconds"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class RateLimiter:
+    """Rate limits requests to Bungie.net with a token bucket per endpoint family
+
+    Endpoint families are the services under /Platform, such as Destiny2, GroupV2
+    and User. Each family gets its own bucket so that a burst of requests to one
+    service doesn't hold back requests to the others.
+    """
+
+    def __init__(self, rate=20, burst=None, family_limits=None):
+        """
+        Args:
+            rate (float) [optional]:
+                Number of requests per second allowed for each family
+            burst (int) [optional]:
+                Maximum burst of requests for each family, the same as rate by default
+            family_limits (dict) [optional]:
+                (rate, burst) overrides keyed by family name (ex. {'GroupV2': (5, 10)})
+        """
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, int(rate))
+        self.family_limits = family_limits or {}
+        self._buckets = {}
+        self._stats = {}
+
+    @staticmethod
+    def family(url):
+        """Get the endpoint family of a Bungie.net URL (ex. 'Destiny2')"""
+        parts = urllib.parse.urlsplit(url).path.strip('/').split('/')
+        if len(parts) > 1 and parts[0] == 'Platform':
+            return parts[1]
+        return parts[0]
+
+    def _bucket(self, family):
+        bucket = self._buckets.get(family)
+        if bucket is None:
+            rate, burst = self.family_limits.get(family, (self.rate, self.burst))
+            bucket = self._buckets[family] = TokenBucket(rate, burst)
+            self._stats[family] = {'requests': 0, 'delayed': 0, 'wait_time': 0.0, 'throttled': 0}
+        return bucket
+
+    async def acquire(self, url):
+        """Wait until a request to the given URL may be sent"""
+        family = self.family(url)
+        waited = await self._bucket(family).acquire()
+        stats = self._stats[family]
+        stats['requests'] += 1
+        if waited > 0:
+            stats['delayed'] += 1
+            stats['wait_time'] += waited
+
+    def throttle(self, url, seconds):
+        """Slow down requests after Bungie.net answered with a ThrottleSeconds value"""
+        family = self.family(url)
+        self._bucket(family).pause(seconds)
+        self._stats[family]['throttled'] += 1
+
+    def stats(self):
+        """Get the number of requests, delayed requests, time spent waiting and
+        throttling responses for each endpoint family
+
+        Returns:
+            dict
+        """
+        return {family: dict(stats) for family, stats in self._stats.items()}
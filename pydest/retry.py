@@ -0,0 +1,127 @@
+import random
+
+# Bungie.net PlatformErrorCodes asking the client to slow down
+THROTTLE_ERROR_CODES = frozenset({
+    36,    # ThrottleLimitExceeded
+    37,    # ThrottleLimitExceededMinutes
+    38,    # ThrottleLimitExceededMomentarily
+    51,    # PerEndpointRequestThrottleExceeded
+    52,    # PerApplicationThrottleExceeded
+    53,    # PerApplicationAnonymousThrottleExceeded
+    54,    # PerApplicationAuthenticatedThrottleExceeded
+    55,    # PerUserThrottleExceeded
+    1672,  # DestinyThrottledByGameServer
+})
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class RetryPolicy:
+    """Decides whether and when a failed request to Bungie.net is sent again
+
+    Retries are spaced out with exponential backoff and full jitter, so that
+    clients which failed together don't all retry together. Only idempotent
+    methods are retried by default.
+    """
+
+    def __init__(self, max_attempts=3, deadline=None, base_delay=0.5, max_delay=10,
+                 retry_error_codes=THROTTLE_ERROR_CODES, retry_statuses=RETRY_STATUSES,
+                 retry_methods=('GET',), on_attempt=None):
+        """
+        Args:
+            max_attempts (int) [optional]:
+                Maximum number of times a request is sent
+            deadline (float) [optional]:
+                Maximum number of seconds to spend on a request, including retries.
+                An attempt still running when the deadline passes is abandoned.
+            base_delay (float) [optional]:
+                Upper bound of the delay before the first retry, in seconds
+            max_delay (float) [optional]:
+                Upper bound of the delay before any retry, in seconds
+            retry_error_codes (iterable) [optional]:
+                Bungie.net ErrorCodes which are retried
+            retry_statuses (iterable) [optional]:
+                HTTP statuses which are retried
+            retry_methods (iterable) [optional]:
+                HTTP methods which are retried
+            on_attempt (callable) [optional]:
+                Called with (method, url, attempt, reason, delay) for every failed
+                attempt that is retried
+        """
+        self.max_attempts = max_attempts
+        self.deadline = deadline
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_error_codes = frozenset(retry_error_codes)
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retry_methods = frozenset(m.upper() for m in retry_methods)
+        self.on_attempt = on_attempt
+        self.attempts = 0
+        self.retries = 0
+        self.failures = 0
+        self.reasons = {}
+
+    def retry_reason(self, method, status=None, error_code=None, error=None):
+        """Get the reason an attempt should be retried, or None if it shouldn't be
+
+        Args:
+            method (str):
+                HTTP method of the request
+            status (int) [optional]:
+                HTTP status of the response
+            error_code (int) [optional]:
+                Bungie.net ErrorCode of the response
+            error (Exception) [optional]:
+                Connection error or timeout raised by the attempt
+
+        Returns:
+            str
+        """
+        if method.upper() not in self.retry_methods:
+            return None
+        if error_code in self.retry_error_codes:
+            return 'ErrorCode {}'.format(error_code)
+        if status in self.retry_statuses:
+            return 'HTTP {}'.format(status)
+        if error is not None and status is None:
+            return type(error).__name__
+        return None
+
+    def delay(self, attempt, throttle_seconds=0):
+        """Get the number of seconds to wait before the next attempt"""
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        return max(backoff, throttle_seconds or 0)
+
+    def remaining(self, elapsed):
+        """Get the number of seconds left before the deadline, or None if there is no deadline"""
+        if self.deadline is None:
+            return None
+        return self.deadline - elapsed
+
+    def should_retry(self, attempt, elapsed, delay):
+        """Check that another attempt fits within max_attempts and the deadline"""
+        if attempt >= self.max_attempts:
+            return False
+        return self.deadline is None or elapsed + delay < self.deadline
+
+    def record(self, method, url, attempt, reason, delay):
+        """Count an attempt, where reason is None if it succeeded or won't be retried"""
+        self.attempts += 1
+        if reason is None:
+            return
+        if delay is None:
+            self.failures += 1
+            return
+        self.retries += 1
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        if self.on_attempt is not None:
+            self.on_attempt(method, url, attempt, reason, delay)
+
+    def stats(self):
+        """Get the number of attempts, retries, requests which failed after being
+        retried, and retries per reason
+
+        Returns:
+            dict
+        """
+        return {'attempts': self.attempts, 'retries': self.retries, 'failures': self.failures,
+                'reasons': dict(self.reasons)}
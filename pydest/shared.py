@@ -0,0 +1,78 @@
+import json
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def version_file(manifest_dir, language):
+    """Get the path of the file recording the manifest installed for a language"""
+    return os.path.join(manifest_dir, 'manifest-{}.version'.format(language))
+
+
+def read_version_file(path):
+    """Read a version file
+
+    Returns:
+        dict: with the manifest file name under 'file', the file it replaced under
+            'previous' and the time of the last version check under 'checked_at',
+            or an empty dict if there is no usable version file
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_version_file(path, info):
+    """Replace a version file atomically, so readers never see a partial one"""
+    fd, staged = tempfile.mkstemp(prefix='.pydest-', dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(info, f)
+        os.replace(staged, path)
+    except BaseException:
+        os.remove(staged)
+        raise
+
+
+def lock_file(path):
+    """Take an exclusive lock shared by every process on the host, waiting for it if needed
+
+    Returns:
+        file: the lock file, to be passed to unlock_file
+    """
+    f = open(path, 'a+')
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after 10 seconds
+                    pass
+    except BaseException:
+        f.close()
+        raise
+    return f
+
+
+def unlock_file(f):
+    """Release a lock taken with lock_file"""
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    finally:
+        f.close()
@@ -0,0 +1,145 @@
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+import tempfile
+from array import array
+from bisect import bisect_left
+
+from pydest.dbase import _path_to_uri
+
+SNAPSHOT_SUFFIX = '.snapshot'
+MAGIC = b'PYDSNAP2'
+# magic, byte order of the index arrays (0 little, 1 big), offset of the directory
+HEADER = struct.Struct('<8sB7xQ')
+BYTE_ORDER = 0 if sys.byteorder == 'little' else 1
+
+
+def snapshot_file(manifest_file):
+    """Get the path of the snapshot sidecar belonging to a manifest file"""
+    return manifest_file + SNAPSHOT_SUFFIX
+
+
+def export_snapshot(manifest_file, snapshot, definitions):
+    """Convert definition tables of a manifest into a binary snapshot
+
+    For each definition the file holds the json of every entry back to back,
+    followed by the sorted table identifiers and the offset of each entry's json,
+    so that an entry is found with a binary search over a memory map. A json
+    directory of the definitions, along with the name of the manifest file they
+    were exported from, is stored at the end of the file. The snapshot
+    is written under a temporary name and moved into place once complete.
+
+    Args:
+        manifest_file (str):
+            Path of the manifest database
+        snapshot (str):
+            Path of the snapshot to create
+        definitions (list):
+            The definitions to include, whose tables must be identified by an integer id
+
+    Raises:
+        sqlite3.OperationalError if a definition table doesn't exist
+    """
+    fd, staged = tempfile.mkstemp(prefix='.pydest-', suffix=SNAPSHOT_SUFFIX, dir=os.path.dirname(snapshot) or '.')
+    try:
+        conn = sqlite3.connect('file:{}?mode=ro'.format(_path_to_uri(manifest_file)), uri=True)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, BYTE_ORDER, 0))
+                directory = {'manifest': os.path.basename(manifest_file), 'tables': {}}
+                for definition in definitions:
+                    ids = array('q')
+                    offsets = array('Q')
+                    for row_id, data in conn.execute("SELECT id, json FROM {} ORDER BY id".format(definition)):
+                        if isinstance(data, str):
+                            data = data.encode('utf-8')
+                        ids.append(row_id)
+                        offsets.append(f.tell())
+                        f.write(data)
+                    offsets.append(f.tell())
+                    f.write(b'\0' * (-f.tell() % 8))
+                    directory['tables'][definition] = [f.tell(), len(ids)]
+                    ids.tofile(f)
+                    offsets.tofile(f)
+                directory_offset = f.tell()
+                f.write(json.dumps(directory).encode('utf-8'))
+                f.seek(0)
+                f.write(HEADER.pack(MAGIC, BYTE_ORDER, directory_offset))
+        finally:
+            conn.close()
+        os.replace(staged, snapshot)
+    except BaseException:
+        os.remove(staged)
+        raise
+
+
+class Snapshot:
+    """A read-only memory map of a snapshot written by export_snapshot
+
+    Opening a snapshot only reads its directory. Entries are read straight from
+    the memory map, so processes using the same snapshot share its pages in the
+    OS page cache.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str):
+                Path of the snapshot
+
+        Raises:
+            ValueError if the file isn't a snapshot written on a machine with the same byte order
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views = []
+        self._tables = {}
+        try:
+            magic, byte_order, directory_offset = HEADER.unpack_from(self._mmap, 0)
+            if magic != MAGIC or byte_order != BYTE_ORDER:
+                raise ValueError("Not a usable manifest snapshot: {}".format(path))
+            directory = json.loads(self._mmap[directory_offset:].decode('utf-8'))
+            if 'manifest' not in directory or 'tables' not in directory:
+                raise ValueError()
+        except (struct.error, ValueError):
+            self.close()
+            raise ValueError("Not a usable manifest snapshot: {}".format(path))
+
+        self.manifest = directory['manifest']
+        for definition, (start, count) in directory['tables'].items():
+            ids = memoryview(self._mmap)[start:start + 8 * count].cast('q')
+            offsets = memoryview(self._mmap)[start + 8 * count:start + 16 * count + 8].cast('Q')
+            self._views.extend([ids, offsets])
+            self._tables[definition] = (ids, offsets)
+
+    def __contains__(self, definition):
+        return definition in self._tables
+
+    @property
+    def definitions(self):
+        """The definitions in the snapshot"""
+        return list(self._tables)
+
+    def get(self, definition, row_id):
+        """Get the json of an entry, undecoded
+
+        Returns:
+            bytes, or None if the entry isn't in the snapshot
+        """
+        ids, offsets = self._tables[definition]
+        i = bisect_left(ids, row_id)
+        if i == len(ids) or ids[i] != row_id:
+            return None
+        return self._mmap[offsets[i]:offsets[i + 1]]
+
+    def close(self):
+        """Unmap the snapshot"""
+        for view in self._views:
+            view.release()
+        self._views = []
+        self._tables = {}
+        self._mmap.close()
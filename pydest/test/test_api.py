@@ -0,0 +1,437 @@
+import pytest
+import asyncio
+import threading
+import time
+
+import pydest
+from pydest.cache import MemoryResponseCache, SQLiteResponseCache
+from pydest.history import ActivityHistorySync
+from pydest.pgcr import PGCRStore
+from pydest.ratelimit import RateLimiter
+from pydest.retry import RetryPolicy
+
+
+class FakeResponse(object):
+
+    def __init__(self, status=200, json=None, headers=None):
+        self.status = status
+        self._json = json
+        self.headers = headers or {}
+
+    async def json(self):
+        return self._json
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class FakeSession(object):
+    """Stands in for an aiohttp session, answering requests from a list of responses"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, headers=None, params=None, json=None):
+        # aiohttp refuses query parameters it can't encode
+        for key, value in (params or {}).items():
+            if not isinstance(value, (str, int, float)):
+                raise TypeError("Invalid variable type: value should be str, int or float, got {!r}".format(value))
+        self.requests.append({'method': method, 'url': url, 'headers': headers, 'params': params})
+        response = self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+        return response
+
+
+class HistorySession(FakeSession):
+    """Answers activity history requests with the requested page of a list of activities"""
+
+    def __init__(self, history):
+        super().__init__()
+        self.history = history
+
+    def request(self, method, url, headers=None, params=None, json=None):
+        count, page = params['count'], params['page']
+        activities = self.history[page * count:(page + 1) * count]
+        self.responses = [ok({'activities': activities} if activities else {})]
+        return super().request(method, url, headers, params, json)
+
+
+def ok(response=None, **headers):
+    return FakeResponse(json={'ErrorCode': 1, 'Message': 'Ok', 'Response': response}, headers=headers)
+
+
+class TestConditionalManifest(object):
+
+    @pytest.mark.asyncio
+    async def test_not_modified(self):
+        session = FakeSession(ok({'version': 'v1'}, ETag='"v1"'), FakeResponse(status=304))
+        api = pydest.API(session)
+        res, headers = await api.get_destiny_manifest_if_modified()
+        assert res['Response']['version'] == 'v1'
+        res, headers = await api.get_destiny_manifest_if_modified(etag=headers['ETag'])
+        assert res is None
+        assert session.requests[1]['headers'] == {'If-None-Match': '"v1"'}
+
+
+class TestRateLimiter(object):
+
+    @pytest.mark.asyncio
+    async def test_burst_then_rate(self):
+        limiter = RateLimiter(rate=100, burst=2)
+        api = pydest.API(FakeSession(ok()), rate_limiter=limiter)
+        start = time.monotonic()
+        for _ in range(4):
+            await api.get_public_milestones()
+        assert time.monotonic() - start >= 0.015
+        await api.get_group(1)
+        stats = limiter.stats()
+        assert stats['Destiny2']['requests'] == 4
+        assert stats['Destiny2']['delayed'] == 2
+        assert stats['GroupV2'] == {'requests': 1, 'delayed': 0, 'wait_time': 0.0, 'throttled': 0}
+
+    @pytest.mark.asyncio
+    async def test_throttle_seconds(self):
+        limiter = RateLimiter(rate=100)
+        throttled = FakeResponse(json={'ErrorCode': 1, 'Message': 'Ok', 'ThrottleSeconds': 0.05})
+        api = pydest.API(FakeSession(throttled, ok()), rate_limiter=limiter)
+        await api.get_public_milestones()
+        start = time.monotonic()
+        await api.get_public_milestones()
+        assert time.monotonic() - start >= 0.04
+        assert limiter.stats()['Destiny2']['throttled'] == 1
+
+
+class TestRetryPolicy(object):
+
+    @pytest.mark.asyncio
+    async def test_retry_until_success(self):
+        policy = RetryPolicy(max_attempts=3, base_delay=0.001)
+        session = FakeSession(FakeResponse(status=503, json={'ErrorCode': 3, 'Message': 'Down'}),
+                              FakeResponse(json={'ErrorCode': 36, 'Message': 'Throttled'}),
+                              ok('milestones'))
+        api = pydest.API(session, retry_policy=policy)
+        res = await api.get_public_milestones()
+        assert res['Response'] == 'milestones'
+        assert policy.stats() == {'attempts': 3, 'retries': 2, 'failures': 0,
+                                  'reasons': {'HTTP 503': 1, 'ErrorCode 36': 1}}
+
+    @pytest.mark.asyncio
+    async def test_gives_up(self):
+        policy = RetryPolicy(max_attempts=2, base_delay=0.001)
+        api = pydest.API(FakeSession(FakeResponse(status=503, json={'ErrorCode': 3, 'Message': 'Down'})),
+                         retry_policy=policy)
+        with pytest.raises(pydest.PydestException):
+            await api.get_public_milestones()
+        assert policy.stats()['attempts'] == 2
+        assert policy.stats()['failures'] == 1
+
+    @pytest.mark.asyncio
+    async def test_post_not_retried(self):
+        policy = RetryPolicy(max_attempts=3, base_delay=0.001)
+        session = FakeSession(FakeResponse(status=503, json={'ErrorCode': 3, 'Message': 'Down'}), ok())
+        api = pydest.API(session, retry_policy=policy)
+        with pytest.raises(pydest.PydestException):
+            await api.group_kick_member(1, 2, 3, 'token')
+        assert len(session.requests) == 1
+
+    @pytest.mark.asyncio
+    async def test_deadline_bounds_attempt(self):
+        policy = RetryPolicy(max_attempts=3, deadline=0.05, base_delay=0.001)
+        session = SlowSession(ok(), delay=5)
+        api = pydest.API(session, retry_policy=policy)
+        started = time.monotonic()
+        with pytest.raises(pydest.PydestException):
+            await api.get_public_milestones()
+        assert time.monotonic() - started < 1
+        assert len(session.requests) == 1
+        assert policy.stats()['failures'] == 1
+
+
+class SlowSession(FakeSession):
+
+    def __init__(self, *responses, delay=0.01):
+        super().__init__(*responses)
+        self.delay = delay
+
+    def request(self, method, url, headers=None, params=None, json=None):
+        response = super().request(method, url, headers=headers, params=params, json=json)
+        return SlowResponse(response, self.delay)
+
+
+class SlowResponse(object):
+
+    def __init__(self, response, delay):
+        self.response = response
+        self.delay = delay
+
+    async def __aenter__(self):
+        await asyncio.sleep(self.delay)
+        return self.response
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class TestCoalescing(object):
+
+    @pytest.mark.asyncio
+    async def test_identical_gets_share_request(self):
+        session = SlowSession(ok({'milestones': [1]}))
+        api = pydest.API(session, coalesce_requests=True)
+        res = await asyncio.gather(*[api.get_public_milestones() for _ in range(5)])
+        assert len(session.requests) == 1
+        assert api.coalesced == 4
+        res[0]['Response']['milestones'].append(2)
+        assert all(r['Response']['milestones'] == [1] for r in res[1:])
+        await api.get_public_milestones()
+        assert len(session.requests) == 2
+
+    @pytest.mark.asyncio
+    async def test_different_tokens_not_shared(self):
+        session = SlowSession(ok())
+        api = pydest.API(session, coalesce_requests=True)
+        await asyncio.gather(api.get_group_pending_members(1, 'a'), api.get_group_pending_members(1, 'b'))
+        assert len(session.requests) == 2
+
+
+class TestResponseCache(object):
+
+    @pytest.mark.asyncio
+    async def test_memory_cache(self):
+        session = FakeSession(ok({'milestones': [1]}))
+        api = pydest.API(session, response_cache=MemoryResponseCache())
+        first = await api.get_public_milestones()
+        first['Response']['milestones'].append(2)
+        second = await api.get_public_milestones()
+        assert second['Response']['milestones'] == [1]
+        assert len(session.requests) == 1
+        await api.get_public_milestones(use_cache=False)
+        assert len(session.requests) == 2
+
+    @pytest.mark.asyncio
+    async def test_sqlite_cache_and_cache_control(self, tmp_path):
+        session = FakeSession(ok(**{'Cache-Control': 'no-cache'}), ok(**{'Cache-Control': 'private, max-age=60'}))
+        cache = SQLiteResponseCache(str(tmp_path / 'responses.db'))
+        api = pydest.API(session, response_cache=cache, cache_ttls={'get_group': 600})
+        await api.get_group(1)
+        await api.get_group(1)
+        await api.get_group(1)
+        assert len(session.requests) == 2
+        cache.close()
+
+    def test_max_age_limits_ttl(self):
+        assert pydest.API._cache_control_ttl('public, max-age=30', 300) == 30
+        assert pydest.API._cache_control_ttl('no-store', 300) == 0
+
+
+class ThreadRecordingCache(MemoryResponseCache):
+
+    def __init__(self):
+        super().__init__()
+        self.threads = []
+
+    def get(self, key):
+        self.threads.append(threading.get_ident())
+        return super().get(key)
+
+    def set(self, key, value, ttl):
+        self.threads.append(threading.get_ident())
+        super().set(key, value, ttl)
+
+
+class TestResponseCacheExecutor(object):
+
+    @pytest.mark.asyncio
+    async def test_backend_called_off_event_loop(self):
+        cache = ThreadRecordingCache()
+        api = pydest.API(FakeSession(ok()), response_cache=cache)
+        await api.get_public_milestones()
+        await api.get_public_milestones()
+        assert len(cache.threads) == 3
+        assert threading.get_ident() not in cache.threads
+
+    @pytest.mark.asyncio
+    async def test_authenticated_requests_not_cached_by_default(self):
+        session = FakeSession(ok({'bungieNetUser': 'a'}))
+        api = pydest.API(session, response_cache=MemoryResponseCache())
+        await api.get_membership_current_user('token-a')
+        await api.get_membership_current_user('token-a')
+        assert len(session.requests) == 2
+
+    @pytest.mark.asyncio
+    async def test_authenticated_requests_cached_per_token(self):
+        session = FakeSession(ok({'bungieNetUser': 'a'}), ok({'bungieNetUser': 'b'}))
+        destiny = pydest.pydest.Pydest('key', response_cache=MemoryResponseCache(),
+                                       response_cache_authenticated=True)
+        await destiny._session.close()
+        destiny.api.session = session
+        assert (await destiny.api.get_membership_current_user('token-a'))['Response'] == {'bungieNetUser': 'a'}
+        assert (await destiny.api.get_membership_current_user('token-b'))['Response'] == {'bungieNetUser': 'b'}
+        assert (await destiny.api.get_membership_current_user('token-a'))['Response'] == {'bungieNetUser': 'a'}
+        assert (await destiny.api.get_membership_current_user('token-b'))['Response'] == {'bungieNetUser': 'b'}
+        assert len(session.requests) == 2
+
+
+class TestPGCRStore(object):
+
+    @pytest.mark.asyncio
+    async def test_read_through(self, tmp_path):
+        session = SlowSession(ok({'activityDetails': {'instanceId': '123'}}))
+        store = PGCRStore(str(tmp_path / 'pgcr.db'))
+        api = pydest.API(session, pgcr_store=store)
+        res = await asyncio.gather(*[api.get_post_game_carnage_report(123) for _ in range(3)])
+        assert all(r['Response']['activityDetails']['instanceId'] == '123' for r in res)
+        assert len(session.requests) == 1
+        await api.get_post_game_carnage_report('123')
+        assert len(session.requests) == 1
+        assert 123 in store
+        store.close()
+
+    def test_import_export(self, tmp_path):
+        store = PGCRStore(str(tmp_path / 'pgcr.db'))
+        store.put(1, {'Response': 'one'})
+        store.put(2, {'Response': 'two'})
+        assert store.export_jsonl(str(tmp_path / 'pgcr.jsonl')) == 2
+        other = PGCRStore(str(tmp_path / 'other.db'))
+        assert other.import_jsonl(str(tmp_path / 'pgcr.jsonl')) == 2
+        assert other.get(2) == {'Response': 'two'}
+        assert other.get(3) is None
+        store.close()
+        other.close()
+
+
+class TestBulkPGCR(object):
+
+    @pytest.mark.asyncio
+    async def test_bounded_stream(self, tmp_path):
+        api = pydest.API(None)
+        in_flight = []
+
+        async def fake_pgcr(activity_id):
+            in_flight.append(activity_id)
+            assert len(in_flight) <= 3
+            await asyncio.sleep(0.001)
+            in_flight.remove(activity_id)
+            if activity_id == 5:
+                raise pydest.PydestPrivateHistoryException("ErrorCode: 1665 - Private")
+            return {'Response': activity_id}
+
+        async def activity_ids():
+            for activity_id in range(10):
+                yield activity_id
+
+        api.get_post_game_carnage_report = fake_pgcr
+        path = str(tmp_path / 'pgcr.jsonl')
+        results = [r async for r in api.iter_post_game_carnage_reports(activity_ids(), concurrency=3, jsonl_path=path)]
+        assert sorted(r[0] for r in results) == list(range(10))
+        errors = [r for r in results if r[2] is not None]
+        assert len(errors) == 1 and errors[0][0] == 5
+        with open(path) as f:
+            assert len(f.readlines()) == 9
+
+
+class TestActivityHistoryIterator(object):
+
+    @pytest.mark.asyncio
+    async def test_walks_pages(self):
+        api = pydest.API(None)
+        requested = []
+
+        async def fake_history(membership_type, membership_id, character_id, count, mode, page):
+            requested.append(page)
+            activities = [{'instanceId': page * count + i} for i in range(count)] if page < 3 else []
+            return {'Response': {'activities': activities} if activities else {}}
+
+        api.get_activity_history = fake_history
+        activities = [a async for a in api.iter_activity_history(1, 2, count=2, prefetch=2)]
+        assert [a['instanceId'] for a in activities] == list(range(6))
+        assert requested[:4] == [0, 1, 2, 3]
+
+    @pytest.mark.asyncio
+    async def test_stop_condition(self):
+        api = pydest.API(None)
+
+        async def fake_history(membership_type, membership_id, character_id, count, mode, page):
+            return {'Response': {'activities': [{'instanceId': page * count + i} for i in range(count)]}}
+
+        api.get_activity_history = fake_history
+        activities = [a async for a in api.iter_activity_history(1, 2, count=5, stop=lambda a: a['instanceId'] == 12)]
+        assert len(activities) == 12
+
+    @pytest.mark.asyncio
+    async def test_request_params(self):
+        session = HistorySession([{'instanceId': i} for i in range(5)])
+        api = pydest.API(session)
+        activities = [a async for a in api.iter_activity_history(1, 123, 456, count=2)]
+        assert len(activities) == 5
+        assert all('mode' not in r['params'] for r in session.requests)
+        activities = [a async for a in api.iter_activity_history(1, 123, 456, mode=4, count=2)]
+        assert session.requests[-1]['params']['mode'] == 4
+
+
+class TestActivityHistorySync(object):
+
+    @pytest.mark.asyncio
+    async def test_only_new_activities(self, tmp_path):
+        history = [{'activityDetails': {'instanceId': str(i)}, 'period': '2019-01-{:02d}T00:00:00Z'.format(i)}
+                   for i in range(30, 0, -1)]
+        session = HistorySession(history)
+        api = pydest.API(session)
+        sync = ActivityHistorySync(api, str(tmp_path / 'history.db'))
+        assert len(await sync.sync(1, 2, 3)) == 30
+        assert await sync.sync(1, 2, 3) == []
+
+        history.insert(0, {'activityDetails': {'instanceId': '31'}, 'period': '2019-01-31T00:00:00Z'})
+        sync.close()
+        # A new instance picks up where the previous one left off
+        sync = ActivityHistorySync(api, str(tmp_path / 'history.db'))
+        session.requests.clear()
+        new = await sync.sync(1, 2, 3)
+        assert [a['activityDetails']['instanceId'] for a in new] == ['31']
+        assert [r['params']['page'] for r in session.requests] == [0]
+        sync.close()
+
+
+class TestGroupProfiles(object):
+
+    @pytest.mark.asyncio
+    async def test_fan_out(self):
+        api = pydest.API(None)
+
+        async def fake_members(group_id, page):
+            results = [{'destinyUserInfo': {'membershipType': 3, 'membershipId': (page - 1) * 2 + i}} for i in range(2)]
+            return {'Response': {'results': results, 'hasMore': page < 3}}
+
+        async def fake_profile(membership_type, membership_id, components):
+            if membership_id == 4:
+                raise pydest.PydestException("ErrorCode: 1601 - DestinyAccountNotFound")
+            return {'Response': {'profile': membership_id}}
+
+        api.get_members_of_group = fake_members
+        api.get_profile = fake_profile
+        results = [r async for r in api.iter_group_profiles(1, [100], concurrency=2)]
+        assert len(results) == 6
+        failed = [member['destinyUserInfo']['membershipId'] for member, _, error in results if error]
+        assert failed == [4]
+
+
+class TestSearchEntitiesIterator(object):
+
+    @pytest.mark.asyncio
+    async def test_follows_paging(self):
+        api = pydest.API(None)
+        requested = []
+
+        async def fake_search(entity_type, search_term, page):
+            requested.append(page)
+            results = [{'hash': page * 2 + i, 'entityType': entity_type} for i in range(2)]
+            return {'Response': {'results': {'results': results[:1] if page == 2 else results, 'totalResults': 5,
+                                             'hasMore': page < 2, 'query': {'itemsPerPage': 2}}}}
+
+        api.search_destiny_entities = fake_search
+        entities = [e async for e in api.iter_search_destiny_entities('DestinyInventoryItemDefinition', 'ace')]
+        assert [e['hash'] for e in entities] == [0, 1, 2, 3, 4]
+        assert sorted(requested) == [0, 1, 2]
@@ -0,0 +1,606 @@
+import pytest
+import asyncio
+import io
+import json
+import os
+import zipfile
+import sqlite3
+
+import pydest
+from pydest.cache import LRUCache
+from pydest.manifest import Manifest
+from pydest.snapshot import export_snapshot
+
+
+def make_manifest(path, rows):
+    """Create a small manifest database containing the given definitions"""
+    conn = sqlite3.connect(str(path))
+    for definition, entries in rows.items():
+        conn.execute('CREATE TABLE {} (id INTEGER PRIMARY KEY, json BLOB)'.format(definition))
+        for hash_id, data in entries.items():
+            conn.execute('INSERT INTO {} VALUES (?, ?)'.format(definition), (hash_id, json.dumps(data)))
+    conn.commit()
+    conn.close()
+    return str(path)
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    manifest_file = make_manifest(tmp_path / 'world.content', {
+        'DestinyClassDefinition': {
+            1: {'hash': 1, 'name': 'Titan'},
+            -1: {'hash': 4294967295, 'name': 'Hunter'},
+        },
+    })
+    m = Manifest(None)
+    m.manifest_files['en'] = manifest_file
+    yield m
+    m.close()
+
+
+class TestConnectionPool(object):
+
+    @pytest.mark.asyncio
+    async def test_connection_reused(self, manifest):
+        await manifest.decode_hash(1, 'DestinyClassDefinition', 'en')
+        conn = manifest._pools['en'].connection()
+        res = await manifest.decode_hash(4294967295, 'DestinyClassDefinition', 'en')
+        assert res['name'] == 'Hunter'
+        assert manifest._pools['en'].connection() is conn
+
+    @pytest.mark.asyncio
+    async def test_pool_swapped_with_file(self, manifest, tmp_path):
+        await manifest.decode_hash(1, 'DestinyClassDefinition', 'en')
+        old_pool = manifest._pools['en']
+        manifest.manifest_files['en'] = make_manifest(tmp_path / 'new.content', {
+            'DestinyClassDefinition': {1: {'name': 'Warlock'}},
+        })
+        res = await manifest.decode_hash(1, 'DestinyClassDefinition', 'en')
+        assert res['name'] == 'Warlock'
+        assert old_pool._closed
+
+    @pytest.mark.asyncio
+    async def test_missing_hash(self, manifest):
+        with pytest.raises(pydest.PydestException):
+            await manifest.decode_hash(2, 'DestinyClassDefinition', 'en')
+
+
+class TestDecodeHashes(object):
+
+    @pytest.mark.asyncio
+    async def test_decode_hashes(self, manifest):
+        res = await manifest.decode_hashes([1, '1', 4294967295, 5], 'DestinyClassDefinition', 'en')
+        assert res[1]['name'] == 'Titan'
+        assert res['1']['name'] == 'Titan'
+        assert res[4294967295]['name'] == 'Hunter'
+        assert res[5] is None
+
+    @pytest.mark.asyncio
+    async def test_decode_hashes_chunked(self, manifest):
+        res = await manifest.decode_hashes(range(2000), 'DestinyClassDefinition', 'en')
+        assert len(res) == 2000
+        assert res[1]['name'] == 'Titan'
+
+    @pytest.mark.asyncio
+    async def test_decode_hashes_invalid_definition(self, manifest):
+        with pytest.raises(pydest.PydestException):
+            await manifest.decode_hashes([1], 'DestinyFakeDefinition', 'en')
+
+
+class TestManifestCache(object):
+
+    @pytest.mark.asyncio
+    async def test_cache_hit(self, manifest):
+        manifest.cache = LRUCache(max_entries=10)
+        first = await manifest.decode_hash(1, 'DestinyClassDefinition', 'en')
+        second = await manifest.decode_hash('1', 'DestinyClassDefinition', 'en')
+        assert first is second
+        assert manifest.cache.hits == 1
+        assert manifest.cache.misses == 1
+
+    @pytest.mark.asyncio
+    async def test_cache_invalidated_on_new_file(self, manifest, tmp_path):
+        manifest.cache = LRUCache(max_entries=10)
+        await manifest.decode_hash(1, 'DestinyClassDefinition', 'en')
+        manifest.manifest_files['en'] = make_manifest(tmp_path / 'new.content', {
+            'DestinyClassDefinition': {1: {'name': 'Warlock'}},
+        })
+        res = await manifest.decode_hash(1, 'DestinyClassDefinition', 'en')
+        assert res['name'] == 'Warlock'
+
+    def test_lru_eviction(self):
+        cache = LRUCache(max_entries=2, max_bytes=10)
+        cache.put('a', 1, size=4)
+        cache.put('b', 2, size=4)
+        cache.get('a')
+        cache.put('c', 3, size=4)
+        assert 'a' in cache and 'c' in cache and 'b' not in cache
+        cache.put('d', 4, size=4)
+        assert cache.stats()['evictions'] == 2
+        assert cache.size <= 10
+
+
+class TestManifestExecutor(object):
+
+    @pytest.mark.asyncio
+    async def test_lookup_in_executor(self, tmp_path):
+        m = Manifest(None, cache=LRUCache(max_entries=10), executor_workers=2)
+        m.manifest_files['en'] = make_manifest(tmp_path / 'world.content', {
+            'DestinyClassDefinition': {1: {'name': 'Titan'}},
+        })
+        res = await m.decode_hashes([1, 2], 'DestinyClassDefinition', 'en')
+        assert res == {1: {'name': 'Titan'}, 2: None}
+        assert (await m.decode_hash(1, 'DestinyClassDefinition', 'en'))['name'] == 'Titan'
+        assert m.cache.hits == 1
+        # The only connection was opened on a worker thread, not the event loop thread
+        assert len(m._pools['en']._conns) == 1
+        assert getattr(m._pools['en']._local, 'conn', None) is None
+        m.close()
+
+
+class TestManifestPreload(object):
+
+    @pytest.mark.asyncio
+    async def test_preload(self, manifest):
+        await manifest.preload(['DestinyClassDefinition'], 'en')
+        assert manifest.preloaded_memory()[('en', 'DestinyClassDefinition')] > 0
+        manifest._pools['en'].close()
+        res = await manifest.decode_hashes([1, 4294967295, 2], 'DestinyClassDefinition', 'en')
+        assert res[1]['name'] == 'Titan'
+        assert res[4294967295]['name'] == 'Hunter'
+        assert res[2] is None
+
+    @pytest.mark.asyncio
+    async def test_preload_dropped_on_new_file(self, manifest, tmp_path):
+        await manifest.preload(['DestinyClassDefinition'], 'en')
+        manifest.manifest_files['en'] = make_manifest(tmp_path / 'new.content', {
+            'DestinyClassDefinition': {1: {'name': 'Warlock'}},
+        })
+        res = await manifest.decode_hash(1, 'DestinyClassDefinition', 'en')
+        assert res['name'] == 'Warlock'
+        assert manifest.preloaded_memory() == {}
+
+    @pytest.mark.asyncio
+    async def test_invalid_definitions_dont_block_install(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        make_manifest(tmp_path / 'world.content', {'DestinyClassDefinition': {1: {'name': 'Titan'}}})
+        api = FakeManifestAPI()
+        m = Manifest(api, preload_definitions=['DestinyClassDefinition', 'DestinyClassDefinitoin'],
+                     index_definitions=['DestinyClassDefinitoin'], snapshot_definitions=['DestinyClassDefinitoin'])
+        assert (await m.decode_hash(1, 'DestinyClassDefinition', 'en'))['name'] == 'Titan'
+        await m.decode_hash(1, 'DestinyClassDefinition', 'en')
+        assert m.manifest_files['en'] == 'world.content'
+        assert list(m.preloaded_memory()) == [('en', 'DestinyClassDefinition')]
+        assert api.calls == [None]
+        with pytest.raises(pydest.PydestException):
+            await m.search_definitions('titan', 'DestinyClassDefinitoin', 'en')
+        m.close()
+
+
+class TestSingleFlightUpdate(object):
+
+    @pytest.mark.asyncio
+    async def test_concurrent_updates_share_one_run(self, tmp_path):
+        manifest_file = make_manifest(tmp_path / 'world.content', {
+            'DestinyClassDefinition': {1: {'name': 'Titan'}},
+        })
+        m = Manifest(None)
+        calls = []
+
+        async def fake_update(language):
+            calls.append(language)
+            await asyncio.sleep(0.01)
+            m.manifest_files[language] = manifest_file
+
+        m._update_manifest = fake_update
+        res = await asyncio.gather(*[m.decode_hash(1, 'DestinyClassDefinition', 'en') for _ in range(20)])
+        assert all(r['name'] == 'Titan' for r in res)
+        await m.decode_hash(1, 'DestinyClassDefinition', 'en')
+        assert calls == ['en']
+        m.close()
+
+    @pytest.mark.asyncio
+    async def test_failure_shared_and_retried(self):
+        m = Manifest(None)
+        calls = []
+
+        async def fake_update(language):
+            calls.append(language)
+            await asyncio.sleep(0.01)
+            raise pydest.PydestException("Could not retrieve Manifest from Bungie.net")
+
+        m._update_manifest = fake_update
+        res = await asyncio.gather(*[m.update_manifest('en') for _ in range(5)], return_exceptions=True)
+        assert all(isinstance(r, pydest.PydestException) for r in res)
+        assert len(calls) == 1
+        with pytest.raises(pydest.PydestException):
+            await m.update_manifest('en')
+        assert len(calls) == 2
+
+
+class FakeManifestAPI(object):
+    """Answers manifest requests like Bungie.net, recording the conditional headers sent"""
+
+    def __init__(self, path='/common/destiny2_content/sqlite/en/world.content'):
+        self.path = path
+        self.calls = []
+
+    async def get_destiny_manifest_if_modified(self, etag=None, last_modified=None):
+        self.calls.append(etag)
+        if etag == '"v1"':
+            return None, {}
+        json_res = {'ErrorCode': 1, 'Response': {'version': 'v1', 'mobileWorldContentPaths': {'en': self.path}}}
+        return json_res, {'ETag': '"v1"'}
+
+
+class TestManifestVersionCheck(object):
+
+    @pytest.mark.asyncio
+    async def test_version_ttl(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        make_manifest(tmp_path / 'world.content', {'DestinyClassDefinition': {1: {'name': 'Titan'}}})
+        api = FakeManifestAPI()
+        m = Manifest(api, version_ttl=60)
+        await m.update_manifest('en')
+        await m.update_manifest('en')
+        assert api.calls == [None]
+        assert m.version == 'v1'
+        assert m.manifest_files['en'] == 'world.content'
+        m.close()
+
+    @pytest.mark.asyncio
+    async def test_conditional_request(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        make_manifest(tmp_path / 'world.content', {'DestinyClassDefinition': {1: {'name': 'Titan'}}})
+        api = FakeManifestAPI()
+        m = Manifest(api)
+        await m.update_manifest('en')
+        await m.update_manifest('en')
+        assert api.calls == [None, '"v1"']
+        assert m.manifest_files['en'] == 'world.content'
+        m.close()
+
+
+class FakeContent(object):
+
+    def __init__(self, data):
+        self._stream = io.BytesIO(data)
+
+    async def read(self, size):
+        return self._stream.read(size)
+
+
+class FakeDownload(object):
+
+    def __init__(self, data):
+        self.status = 200
+        self.content_length = len(data)
+        self.content = FakeContent(data)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class FakeDownloadSession(object):
+
+    def __init__(self, data):
+        self.data = data
+        self.urls = []
+
+    def get(self, url, timeout=None):
+        self.urls.append(url)
+        return FakeDownload(self.data)
+
+
+def zip_manifest(tmp_path, name, rows):
+    """Build the zip archive Bungie.net serves for a manifest database"""
+    manifest_file = make_manifest(tmp_path / name, rows)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zip_ref:
+        zip_ref.write(manifest_file, name)
+    os.remove(manifest_file)
+    return archive.getvalue()
+
+
+class TestManifestDownload(object):
+
+    @pytest.mark.asyncio
+    async def test_download_and_extract(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        api = FakeManifestAPI()
+        api.session = FakeDownloadSession(zip_manifest(tmp_path, 'world.content', {
+            'DestinyClassDefinition': {1: {'name': 'Titan'}},
+        }))
+        progress = []
+        m = Manifest(api, download_chunk_size=64, download_progress=lambda done, total: progress.append(done))
+        res = await m.decode_hash(1, 'DestinyClassDefinition', 'en')
+        assert res['name'] == 'Titan'
+        assert progress[-1] == len(api.session.data)
+        assert len(progress) > 1
+        assert sorted(os.listdir(tmp_path)) == ['world.content']
+        m.close()
+
+
+class TestManifestSwap(object):
+
+    @pytest.mark.asyncio
+    async def test_old_manifest_removed_after_last_reader(self, tmp_path):
+        api = FakeManifestAPI(path='/common/destiny2_content/sqlite/en/new.content')
+        api.session = FakeDownloadSession(zip_manifest(tmp_path, 'new.content', {
+            'DestinyClassDefinition': {1: {'name': 'Warlock'}},
+        }))
+        m = Manifest(api, manifest_dir=str(tmp_path))
+        m.manifest_files['en'] = make_manifest(tmp_path / 'old.content', {
+            'DestinyClassDefinition': {1: {'name': 'Titan'}},
+        })
+        old_pool = m._pool('en')
+        with old_pool.reading():
+            await m.update_manifest('en')
+            assert (await m.decode_hash(1, 'DestinyClassDefinition', 'en'))['name'] == 'Warlock'
+            # The old manifest is still readable by the lookup that was in progress
+            with old_pool.db() as db:
+                assert db.query_many([1], 'DestinyClassDefinition', 'id')
+        assert old_pool._closed
+        assert sorted(os.listdir(tmp_path)) == ['new.content']
+        m.close()
+
+    @pytest.mark.asyncio
+    async def test_corrupt_manifest_rejected(self, tmp_path):
+        corrupt = io.BytesIO()
+        with zipfile.ZipFile(corrupt, 'w') as zip_ref:
+            zip_ref.writestr('new.content', b'not a database' * 100)
+        api = FakeManifestAPI(path='/common/destiny2_content/sqlite/en/new.content')
+        api.session = FakeDownloadSession(corrupt.getvalue())
+        m = Manifest(api, manifest_dir=str(tmp_path))
+        m.manifest_files['en'] = make_manifest(tmp_path / 'old.content', {
+            'DestinyClassDefinition': {1: {'name': 'Titan'}},
+        })
+        with pytest.raises(pydest.PydestException):
+            await m.update_manifest('en')
+        assert (await m.decode_hash(1, 'DestinyClassDefinition', 'en'))['name'] == 'Titan'
+        assert sorted(os.listdir(tmp_path)) == ['old.content']
+        m.close()
+
+
+class TestManifestRefresh(object):
+
+    @pytest.mark.asyncio
+    async def test_refresh(self, tmp_path):
+        api = FakeManifestAPI()
+        api.session = FakeDownloadSession(zip_manifest(tmp_path, 'world.content', {
+            'DestinyClassDefinition': {1: {'name': 'Titan'}},
+        }))
+        m = Manifest(api, manifest_dir=str(tmp_path))
+        m.start_refresh(['en'], interval=0.01)
+        await asyncio.wait_for(m.wait_ready(), 1)
+        assert m.manifest_files['en'] == str(tmp_path / 'world.content')
+        await asyncio.sleep(0.05)
+        assert len(api.calls) > 1
+        assert len(api.session.urls) == 1
+        await m.stop_refresh()
+        assert m._refresh_task is None
+        m.close()
+
+    @pytest.mark.asyncio
+    async def test_refresh_survives_maintenance(self, tmp_path):
+        api = FakeManifestAPI()
+        api.session = FakeDownloadSession(zip_manifest(tmp_path, 'world.content', {
+            'DestinyClassDefinition': {1: {'name': 'Titan'}},
+        }))
+        get_manifest = api.get_destiny_manifest_if_modified
+
+        async def maintenance_once(*args, **kwargs):
+            api.get_destiny_manifest_if_modified = get_manifest
+            raise pydest.PydestMaintenanceException()
+
+        api.get_destiny_manifest_if_modified = maintenance_once
+        m = Manifest(api, manifest_dir=str(tmp_path))
+        m.start_refresh(['en'], interval=0.01)
+        await asyncio.wait_for(m.wait_ready(), 1)
+        assert not m._refresh_task.done()
+        await m.stop_refresh()
+        m.close()
+
+    @pytest.mark.asyncio
+    async def test_stop_failed_refresh(self):
+        m = Manifest(None)
+        m._refresh_task = asyncio.get_event_loop().create_future()
+        m._refresh_task.set_exception(pydest.PydestMaintenanceException())
+        await m.stop_refresh()
+        assert m._refresh_task is None
+        m.close()
+
+
+class TestHydrate(object):
+
+    @pytest.mark.asyncio
+    async def test_hydrate(self, tmp_path):
+        m = Manifest(None)
+        m.manifest_files['en'] = make_manifest(tmp_path / 'world.content', {
+            'DestinyClassDefinition': {1: {'name': 'Titan'}},
+            'DestinyRaceDefinition': {2: {'name': 'Exo'}},
+        })
+        queries = []
+        query = m._query
+        m._query = lambda *args: queries.append(args[1]) or query(*args)
+        profile = {'characters': {'data': {'10': {'classHash': 1, 'raceHash': 2},
+                                           '11': {'classHash': 1, 'raceHash': 3, 'emblemHash': 0}}}}
+        table = await pydest.hydrate.hydrate(m, profile, inline=True)
+        assert table == {'DestinyClassDefinition': {1: {'name': 'Titan'}},
+                         'DestinyRaceDefinition': {2: {'name': 'Exo'}, 3: None}}
+        assert sorted(queries) == ['DestinyClassDefinition', 'DestinyRaceDefinition']
+        characters = profile['characters']['data']
+        assert characters['10']['classDefinition']['name'] == 'Titan'
+        assert characters['10']['raceDefinition']['name'] == 'Exo'
+        assert 'raceDefinition' not in characters['11']
+        m.close()
+
+
+class TestSearchDefinitions(object):
+
+    @pytest.fixture
+    def items(self, tmp_path):
+        m = Manifest(None, index_definitions=['DestinyInventoryItemDefinition'])
+        m.manifest_files['en'] = make_manifest(tmp_path / 'world.content', {
+            'DestinyInventoryItemDefinition': {
+                1: {'displayProperties': {'name': 'Ace of Spades', 'description': 'Hand cannon'}},
+                2: {'displayProperties': {'name': 'Gjallarhorn', 'description': 'Rocket launcher'}},
+                3: {'displayProperties': {'name': 'Spade Shader', 'description': 'Worn by an ace'}},
+                4: {'displayProperties': {'name': '', 'description': ''}},
+            },
+        })
+        yield m
+        m.close()
+
+    @pytest.mark.asyncio
+    async def test_prefix_search(self, items):
+        res = await items.search_definitions('ace spa', 'DestinyInventoryItemDefinition', 'en')
+        assert [r['displayProperties']['name'] for r in res] == ['Ace of Spades', 'Spade Shader']
+        assert os.path.isfile(items.manifest_files['en'] + '.index')
+
+    @pytest.mark.asyncio
+    async def test_fuzzy_search(self, items):
+        res = await items.search_definitions('gjalarhorn', 'DestinyInventoryItemDefinition', 'en')
+        assert [r['displayProperties']['name'] for r in res] == ['Gjallarhorn']
+        assert await items.search_definitions('gjalarhorn', 'DestinyInventoryItemDefinition', 'en',
+                                              fuzzy=False) == []
+
+    @pytest.mark.asyncio
+    async def test_not_indexed(self, items):
+        with pytest.raises(pydest.PydestException):
+            await items.search_definitions('titan', 'DestinyClassDefinition', 'en')
+
+
+class TestQueryDefinitions(object):
+
+    @pytest.fixture
+    def items(self, tmp_path):
+        m = Manifest(None, index_fields={'DestinyInventoryItemDefinition': ['itemType', 'inventory.tierType',
+                                                                            'itemCategoryHashes']})
+        m.manifest_files['en'] = make_manifest(tmp_path / 'world.content', {
+            'DestinyInventoryItemDefinition': {
+                1: {'hash': 1, 'itemType': 3, 'inventory': {'tierType': 6}, 'itemCategoryHashes': [1, 2]},
+                -2: {'hash': 4294967294, 'itemType': 3, 'inventory': {'tierType': 5}, 'itemCategoryHashes': [2]},
+                3: {'hash': 3, 'itemType': 2, 'inventory': {'tierType': 6}},
+            },
+        })
+        yield m
+        m.close()
+
+    @pytest.mark.asyncio
+    async def test_query(self, items):
+        res = await items.query_definitions('DestinyInventoryItemDefinition',
+                                            {'itemType': 3, 'inventory.tierType': 6}, 'en')
+        assert list(res) == [1]
+        hashes = await items.query_hashes('DestinyInventoryItemDefinition',
+                                          {'itemType': 3, 'inventory.tierType': [5, 6]}, 'en')
+        assert sorted(hashes) == [1, 4294967294]
+        assert await items.query_hashes('DestinyInventoryItemDefinition', {'itemCategoryHashes': 1}, 'en') == [1]
+
+    @pytest.mark.asyncio
+    async def test_field_not_indexed(self, items):
+        with pytest.raises(pydest.PydestException):
+            await items.query_hashes('DestinyInventoryItemDefinition', {'classType': 1}, 'en')
+
+
+class TestSnapshot(object):
+
+    @pytest.mark.asyncio
+    async def test_snapshot_exported_on_update(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        make_manifest(tmp_path / 'world.content', {'DestinyClassDefinition': {-1: {'name': 'Hunter'}}})
+        m = Manifest(FakeManifestAPI(), snapshot_definitions=['DestinyClassDefinition'])
+        await m.update_manifest('en')
+        assert os.path.isfile('world.content.snapshot')
+        m._pools['en'].close()
+        assert (await m.decode_hash(4294967295, 'DestinyClassDefinition', 'en'))['name'] == 'Hunter'
+        m.close()
+
+    @pytest.mark.asyncio
+    async def test_load_snapshot(self, tmp_path):
+        manifest_file = make_manifest(tmp_path / 'world.content', {
+            'DestinyClassDefinition': {1: {'name': 'Titan'}, -1: {'name': 'Hunter'}},
+        })
+        export_snapshot(manifest_file, str(tmp_path / 'world.snapshot'), ['DestinyClassDefinition'])
+        os.remove(manifest_file)
+
+        m = Manifest(None)
+        await m.load_snapshot(str(tmp_path / 'world.snapshot'), 'en')
+        res = await m.decode_hashes([1, 4294967295, 2], 'DestinyClassDefinition', 'en')
+        assert res == {1: {'name': 'Titan'}, 4294967295: {'name': 'Hunter'}, 2: None}
+        with pytest.raises(pydest.PydestException):
+            await m.decode_hash(2, 'DestinyClassDefinition', 'en')
+        m.close()
+
+
+class TestSharedManifest(object):
+
+    @pytest.mark.asyncio
+    async def test_version_file_adopted(self, tmp_path):
+        make_manifest(tmp_path / 'world.content', {'DestinyClassDefinition': {1: {'name': 'Titan'}}})
+        leader_api, follower_api = FakeManifestAPI(), FakeManifestAPI()
+        leader = Manifest(leader_api, version_ttl=60, manifest_dir=str(tmp_path), shared=True, mmap_size=1 << 20)
+        follower = Manifest(follower_api, version_ttl=60, manifest_dir=str(tmp_path), shared=True)
+        await leader.update_manifest('en')
+        await follower.update_manifest('en')
+        assert leader_api.calls == [None]
+        assert follower_api.calls == []
+        assert follower.manifest_files['en'] == leader.manifest_files['en']
+        assert (await follower.decode_hash(1, 'DestinyClassDefinition', 'en'))['name'] == 'Titan'
+        assert (await leader.decode_hash(1, 'DestinyClassDefinition', 'en'))['name'] == 'Titan'
+        assert leader._pools['en'].connection().execute('PRAGMA mmap_size').fetchone() == (1 << 20,)
+        leader.close()
+        follower.close()
+
+    @pytest.mark.asyncio
+    async def test_replaced_manifest_kept_for_one_version(self, tmp_path):
+        for name in ('a.content', 'b.content', 'c.content'):
+            make_manifest(tmp_path / name, {'DestinyClassDefinition': {1: {'name': name}}})
+        m = Manifest(None, manifest_dir=str(tmp_path), shared=True)
+        for name in ('a.content', 'b.content', 'c.content'):
+            m.api = FakeManifestAPI(path='/common/destiny2_content/sqlite/en/' + name)
+            m._version_info = {}
+            await m.update_manifest('en')
+        assert sorted(f for f in os.listdir(tmp_path) if f.endswith('.content')) == ['b.content', 'c.content']
+        with open(tmp_path / 'manifest-en.version') as f:
+            info = json.load(f)
+        assert (info['file'], info['previous']) == ('c.content', 'b.content')
+        m.close()
+
+    @pytest.mark.asyncio
+    async def test_snapshot_kept_for_database_lookups(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        make_manifest(tmp_path / 'world.content', {
+            'DestinyClassDefinition': {1: {'name': 'Titan'}},
+            'DestinyRaceDefinition': {2: {'name': 'Exo'}},
+        })
+        export_snapshot('world.content', 'world.snapshot', ['DestinyClassDefinition'])
+
+        m = Manifest(FakeManifestAPI())
+        await m.load_snapshot('world.snapshot', 'en')
+        assert (await m.decode_hash(2, 'DestinyRaceDefinition', 'en'))['name'] == 'Exo'
+        assert 'en' in m._snapshots
+        m._pools['en'].close()
+        assert (await m.decode_hash(1, 'DestinyClassDefinition', 'en'))['name'] == 'Titan'
+        m.close()
+
+    @pytest.mark.asyncio
+    async def test_old_snapshot_dropped_for_new_manifest(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        make_manifest(tmp_path / 'old.content', {'DestinyClassDefinition': {1: {'name': 'OLD'}}})
+        export_snapshot('old.content', 'old.snapshot', ['DestinyClassDefinition'])
+        make_manifest(tmp_path / 'new.content', {
+            'DestinyClassDefinition': {1: {'name': 'NEW'}},
+            'DestinyRaceDefinition': {2: {'name': 'NEWRACE'}},
+        })
+
+        m = Manifest(FakeManifestAPI(path='/common/destiny2_content/sqlite/en/new.content'))
+        await m.load_snapshot('old.snapshot', 'en')
+        assert (await m.decode_hash(1, 'DestinyClassDefinition', 'en'))['name'] == 'OLD'
+        assert (await m.decode_hash(2, 'DestinyRaceDefinition', 'en'))['name'] == 'NEWRACE'
+        assert 'en' not in m._snapshots
+        assert (await m.decode_hash(1, 'DestinyClassDefinition', 'en'))['name'] == 'NEW'
+        m.close()
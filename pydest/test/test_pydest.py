@@ -44,3 +44,15 @@ class TestClose(object):
         destiny = pydest.Pydest('123')
         await destiny.close()
         assert destiny._session.closed
+
+
+class TestManifestDownload(object):
+
+    @pytest.mark.asyncio
+    async def test_download_settings_passed_to_manifest(self):
+        destiny = pydest.pydest.Pydest('123', manifest_download_chunk_size=4096, manifest_download_timeout=120,
+                                       manifest_download_idle_timeout=15)
+        await destiny.close()
+        assert destiny._manifest.download_chunk_size == 4096
+        assert destiny._manifest.download_timeout == 120
+        assert destiny._manifest.download_idle_timeout == 15